@@ -0,0 +1,3 @@
+"""
+The todo application package. The application itself is built by main.create_app (main.todo_api is the default instance).
+"""
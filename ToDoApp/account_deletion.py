@@ -0,0 +1,121 @@
+"""
+Module for deleting user accounts without loading their rows.
+
+Every table referencing a user deletes its rows with the user (ON DELETE CASCADE), so the rows are never loaded into
+the session. Small accounts are deleted right away with a few set-based deletes. Large accounts (more than
+USER_DELETE_SYNC_MAX_TODOS todos, known from the todo counters) are deactivated at once and their rows are deleted in
+chunks by the purge_deleted_users maintenance job, so no single transaction holds locks on many rows.
+"""
+
+from datetime import datetime
+from sqlalchemy import delete, select, update
+from .cache import todo_cache, user_cache
+from .routers.auth import revoke_refresh_tokens
+from . import config
+from . import models
+
+#The rows referencing a user: (model, column of the user id, primary key)
+USER_ROWS = (
+    (models.ToDos, models.ToDos.owner_id, models.ToDos.todo_id),
+    (models.TodosArchive, models.TodosArchive.owner_id, models.TodosArchive.todo_id),
+    (models.RefreshTokens, models.RefreshTokens.user_id, models.RefreshTokens.token_id)
+)
+
+
+def is_large_account(db, user_id: int) -> bool:
+    summary = db.get(models.TodoSummary, user_id)
+    return summary is not None and summary.open_count + summary.completed_count > config.USER_DELETE_SYNC_MAX_TODOS
+
+
+def delete_user_now(db, user_id: int) -> bool:
+    """
+    Deletes the user, its rows and its address with set-based deletes. The caller commits.
+
+    ------
+    Returns
+    bool False if the user does not exist
+    """
+    address_id = db.execute(select(models.Users.address_id).where(models.Users.user_id == user_id)).first()
+
+    if address_id is None:
+        return False
+
+    #Deleted explicitly as well, so databases created before the cascades were added are handled the same way.
+    for model, user_column, _ in USER_ROWS:
+        db.execute(delete(model).where(user_column == user_id).execution_options(synchronize_session=False))
+
+    db.execute(delete(models.Users).where(models.Users.user_id == user_id).execution_options(synchronize_session=False))
+
+    if address_id[0] is not None:
+        db.execute(delete(models.Address).where(models.Address.id == address_id[0]))
+
+    return True
+
+
+def schedule_deletion(db, user_id: int) -> bool:
+    """
+    Deactivates the user (it can no longer log in or renew its tokens) and marks it for the purge job. The caller commits.
+
+    ------
+    Returns
+    bool False if the user does not exist
+    """
+    marked = db.execute(
+        update(models.Users)
+        .where(models.Users.user_id == user_id)
+        .values(is_active=False, deleted_at=datetime.utcnow())
+    ).rowcount
+
+    if marked:
+        revoke_refresh_tokens(db, user_id)
+
+    return bool(marked)
+
+
+def after_deletion(user_id: int) -> None:
+    """Invalidates the caches of the user. To be called after the deletion (or the mark) is committed."""
+    user_cache.invalidate(user_id)
+    todo_cache.invalidate(user_id)
+
+
+def purge_deleted_users(db, batch_size: int = 1000) -> int:
+    """
+    Deletes up to batch_size rows of the user marked for deletion first, then the user itself once nothing is left,
+    and commits.
+
+    ------
+    Returns
+    int of the number of deleted rows
+    """
+    user_id = db.execute(
+        select(models.Users.user_id)
+        .where(models.Users.deleted_at.is_not(None))
+        .order_by(models.Users.deleted_at)
+        .limit(1)
+    ).scalar()
+
+    if user_id is None:
+        return 0
+
+    deleted = 0
+
+    for model, user_column, primary_key in USER_ROWS:
+        if deleted >= batch_size:
+            break
+
+        chunk = select(primary_key).where(user_column == user_id).limit(batch_size - deleted).scalar_subquery()
+        deleted += db.execute(delete(model).where(primary_key.in_(chunk)).execution_options(synchronize_session=False)).rowcount
+
+    #Nothing of the user is left, the user itself goes in the same transaction as the last chunk.
+    finished = deleted < batch_size
+
+    if finished:
+        delete_user_now(db, user_id)
+        deleted += 1
+
+    db.commit()
+
+    if finished:
+        after_deletion(user_id)
+
+    return deleted
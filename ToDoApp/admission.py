@@ -0,0 +1,257 @@
+"""
+Module for admission control: a limit on the number of requests served at once, adapted to the observed latency (AIMD).
+
+While the requests finish within ADMISSION_TARGET_LATENCY_MS the limit grows slowly (additive increase), and when they
+get slower or fail it is cut (multiplicative decrease), so when the database slows down fewer requests pile up inside
+the workers. Requests above the limit wait in a queue for a short time, and are answered with a fast 503 if no slot
+frees up in time or the queue is full.
+
+Some routes are slow by design (login and sign up hash the password with bcrypt), so every route keeps a baseline of its
+usual latency: a request only counts as slow if it takes longer than the target and than ADMISSION_LATENCY_TOLERANCE
+times the baseline of its route.
+
+Requests have a priority class. The higher classes may use more of the limit and are admitted first from the queue:
+- critical: login, token refresh and the ops endpoints
+- read: GET requests
+- write: everything else
+"""
+
+import asyncio
+import time
+from collections import deque
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from . import config
+
+PRIORITIES = ("critical", "read", "write")
+
+#Part of the limit each class may use, so reads and logins keep some room when writes pile up.
+LIMIT_SHARES = {"critical": 1.0, "read": 0.9, "write": 0.7}
+
+CRITICAL_PREFIXES = ("/auth", "/ops")
+
+#Weight of a new latency in the baseline of its route. Slow requests move it much less, so a slowdown is not taken for the
+#new normal right away, but a route that stays slower (e.g. a grown table) is adopted after a while.
+BASELINE_WEIGHT = 0.1
+SLOW_BASELINE_WEIGHT = 0.01
+#Routes with a baseline at most, the ones beyond (e.g. scans of random paths) are only held to the target latency.
+MAX_ROUTES = 1024
+
+
+class AIMDLimiter:
+    def __init__(self,
+                 initial_limit: int,
+                 min_limit: int,
+                 max_limit: int,
+                 target_latency: float,
+                 queue_timeout: float,
+                 max_queue: int,
+                 tolerance: float = 2.0,
+                 backoff: float = 0.9) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.tolerance = tolerance
+        self.backoff = backoff
+        #route -> float seconds of its usual latency
+        self._baselines = {}
+        self.in_flight = 0
+        self._waiters = {priority: deque() for priority in PRIORITIES}
+        self._last_decrease = 0.0
+        self._stats = {priority: {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "slow": 0, "failed": 0} for priority in PRIORITIES}
+
+    def _capacity(self, priority: str) -> int:
+        return max(1, int(self.limit * LIMIT_SHARES[priority]))
+
+    def _queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _waiting_before(self, priority: str) -> bool:
+        #Requests of the same or a higher class that are already queued go first.
+        return any(self._waiters[other] for other in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    async def acquire(self, priority: str) -> bool:
+        """
+        Takes a slot, waiting for one at most queue_timeout seconds.
+
+        ------
+        Parameters
+        priority: str of the priority class of the request (see PRIORITIES)
+
+        ------
+        Returns
+        bool True if the request is admitted (release must be called when it is done), False if it is rejected
+        """
+        stats = self._stats[priority]
+
+        if self.in_flight < self._capacity(priority) and not self._waiting_before(priority):
+            self.in_flight += 1
+            stats["admitted"] += 1
+            return True
+
+        if self._queued() >= self.max_queue:
+            stats["rejected"] += 1
+            return False
+
+        stats["queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+
+        try:
+            #The slot is handed over by release, which counts it as in flight already.
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            stats["timed_out"] += 1
+            return False
+        except asyncio.CancelledError:
+            #The client went away right after it was handed a slot.
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters[priority]:
+                self._waiters[priority].remove(waiter)
+
+        stats["admitted"] += 1
+        return True
+
+    def _is_slow(self, route: str, latency: float) -> bool:
+        """
+        Returns True if the request took longer than the target latency and than the tolerance times the baseline of its
+        route, and moves the baseline towards the latency.
+        """
+        baseline = self._baselines.get(route)
+
+        if baseline is None:
+            if route is None or len(self._baselines) >= MAX_ROUTES:
+                return latency > self.target_latency
+
+            #The first request of a route sets its baseline.
+            self._baselines[route] = latency
+            return False
+
+        slow = latency > max(self.target_latency, baseline * self.tolerance)
+        self._baselines[route] = baseline + (SLOW_BASELINE_WEIGHT if slow else BASELINE_WEIGHT) * (latency - baseline)
+
+        return slow
+
+    def release(self, priority: str, latency: float, failed: bool, route: str = None) -> None:
+        """
+        Frees the slot of a finished request and adapts the limit to how it went.
+
+        ------
+        Parameters
+        priority: str of the priority class of the request
+        latency: float of the seconds the request took
+        failed: bool if it failed (exception or 5xx response)
+        route: str of the route of the request (see request_route), None holds it to the target latency only
+        """
+        self.in_flight -= 1
+
+        if failed or self._is_slow(route, latency):
+            self._stats[priority]["failed" if failed else "slow"] += 1
+            now = time.monotonic()
+
+            #Decreases at most once per target latency, as the requests that started before the decrease finish slow as well.
+            if now - self._last_decrease > self.target_latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+
+        elif self.in_flight + 1 >= self.limit / 2:
+            #Grows by about one per limit's worth of fast requests, and only while the limit is actually used.
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        self._wake()
+
+    def _wake(self) -> None:
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+
+            while waiters and self.in_flight < self._capacity(priority):
+                waiter = waiters.popleft()
+
+                if not waiter.done():
+                    self.in_flight += 1
+                    waiter.set_result(True)
+
+            #Lower classes do not jump ahead of a higher class that is still waiting.
+            if waiters:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": {priority: len(waiters) for priority, waiters in self._waiters.items()},
+            "baselines_ms": {route: round(baseline * 1000, 1) for route, baseline in self._baselines.items()},
+            "classes": self._stats
+        }
+
+
+admission_limiter = AIMDLimiter(
+    initial_limit=config.ADMISSION_INITIAL_LIMIT,
+    min_limit=config.ADMISSION_MIN_LIMIT,
+    max_limit=config.ADMISSION_MAX_LIMIT,
+    target_latency=config.ADMISSION_TARGET_LATENCY_MS / 1000,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT_MS / 1000,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    tolerance=config.ADMISSION_LATENCY_TOLERANCE
+)
+
+
+def request_route(scope: Scope) -> str:
+    """Returns the method and path of the request, with the ids in the path replaced by *, e.g. GET /todos/edit-todo/*."""
+    path = "/".join("*" if part.isdigit() else part for part in scope["path"].split("/"))
+    return f"{scope['method']} {path}"
+
+
+def request_priority(scope: Scope) -> str:
+    if scope["path"].startswith(CRITICAL_PREFIXES):
+        return "critical"
+
+    if scope["method"] in ("GET", "HEAD"):
+        return "read"
+
+    return "write"
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware admitting requests through the limiter, and answering the rejected ones with a 503 right away.
+    Long-lived responses (the event stream) and the static files are not limited.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: AIMDLimiter = admission_limiter, exclude_prefixes: tuple = ()) -> None:
+        self.app = app
+        self.limiter = limiter
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        priority = request_priority(scope)
+
+        if not await self.limiter.acquire(priority):
+            response = JSONResponse({"detail": "Service overloaded, try again later"}, status_code=503, headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        failed = True
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal failed
+            if message["type"] == "http.response.start":
+                failed = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.limiter.release(priority, time.monotonic() - started, failed, request_route(scope))
@@ -1,11 +1,10 @@
-import sys
-sys.path.append("...")
-
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
-from sqlalchemy import pool
+from sqlalchemy import pool, text
 from alembic import context
-import models
+from ToDoApp.database import SQLALCHEMY_DATABASE_URL
+from ToDoApp.config import MIGRATION_LOCK_TIMEOUT, MIGRATION_STATEMENT_TIMEOUT
+from ToDoApp import models
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -13,6 +12,9 @@ config = context.config
 fileConfig(config.config_file_name)
 target_metadata = models.Base.metadata
 
+#Migrations run against the database the application is configured with (DATABASE_URL).
+config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 # if config.config_file_name is not None:
@@ -68,8 +70,22 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        #A migration statement gives up after waiting MIGRATION_LOCK_TIMEOUT for a lock, instead of queueing every
+        #query of the application behind it, and after running MIGRATION_STATEMENT_TIMEOUT (see online_migrations.py).
+        if connection.dialect.name == "postgresql":
+            connection.execute(
+                text("SELECT set_config('lock_timeout', :lock_timeout, false), set_config('statement_timeout', :statement_timeout, false)"),
+                {"lock_timeout": MIGRATION_LOCK_TIMEOUT, "statement_timeout": MIGRATION_STATEMENT_TIMEOUT}
+            )
+
+        #SQLite can not alter tables, batch mode recreates them instead.
+        #Every migration commits on its own, so the online migrations can run statements outside of a transaction
+        #(autocommit_block) and a failed migration does not roll back the ones before it.
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
+            transaction_per_migration=True
         )
 
         with context.begin_transaction():
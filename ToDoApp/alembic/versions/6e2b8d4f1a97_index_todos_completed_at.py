@@ -0,0 +1,26 @@
+"""index todos completed_at
+
+Revision ID: 6e2b8d4f1a97
+Revises: b7e4c91d2f63
+Create Date: 2026-10-19 20:12:48.317405
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from ToDoApp.online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2b8d4f1a97'
+down_revision = 'b7e4c91d2f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    #Built concurrently, writes to todos are not blocked while it builds.
+    create_index_concurrently("ix_todos_completed_at", "todos", ["completed_at"])
+
+
+def downgrade() -> None:
+    drop_index_concurrently("ix_todos_completed_at", "todos")
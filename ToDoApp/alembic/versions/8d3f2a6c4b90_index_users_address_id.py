@@ -0,0 +1,26 @@
+"""index users address_id
+
+Revision ID: 8d3f2a6c4b90
+Revises: 5c1e8f0b7a21
+Create Date: 2026-10-19 19:48:12.540127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from ToDoApp.online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f2a6c4b90'
+down_revision = '5c1e8f0b7a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    #Built concurrently, writes to users are not blocked while it builds.
+    create_index_concurrently("ix_users_address_id", "users", ["address_id"])
+
+
+def downgrade() -> None:
+    drop_index_concurrently("ix_users_address_id", "users")
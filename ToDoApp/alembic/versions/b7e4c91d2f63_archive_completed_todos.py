@@ -0,0 +1,40 @@
+"""archive completed todos
+
+Revision ID: b7e4c91d2f63
+Revises: 8d3f2a6c4b90
+Create Date: 2026-10-19 20:11:37.902214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4c91d2f63'
+down_revision = '8d3f2a6c4b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    #The index is built concurrently by the next revision, todos is large and written to all the time.
+    op.add_column("todos", sa.Column("completed_at", sa.DateTime(), nullable=True))
+
+    op.create_table(
+        "todos_archive",
+        sa.Column("todo_id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("priority", sa.Integer(), nullable=True),
+        sa.Column("complete", sa.Boolean(), nullable=True),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.user_id"), nullable=True),
+        sa.Column("archived_at", sa.DateTime(), nullable=False)
+    )
+    op.create_index("ix_todos_archive_owner_id", "todos_archive", ["owner_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_todos_archive_owner_id", table_name="todos_archive")
+    op.drop_table("todos_archive")
+    op.drop_column("todos", "completed_at")
@@ -0,0 +1,26 @@
+"""index todos owner_id
+
+Revision ID: c2a9d5e81f04
+Revises: 6e2b8d4f1a97
+Create Date: 2026-10-19 20:34:05.661893
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from ToDoApp.online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a9d5e81f04'
+down_revision = '6e2b8d4f1a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    #Built concurrently, writes to todos are not blocked while it builds.
+    create_index_concurrently("ix_todos_owner_id", "todos", ["owner_id"])
+
+
+def downgrade() -> None:
+    drop_index_concurrently("ix_todos_owner_id", "todos")
@@ -0,0 +1,50 @@
+"""create todo summary table
+
+Revision ID: d5f0c3a9e712
+Revises: c2a9d5e81f04
+Create Date: 2026-10-19 21:02:17.483920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f0c3a9e712'
+down_revision = 'c2a9d5e81f04'
+branch_labels = None
+depends_on = None
+
+PRIORITIES = (1, 2, 3, 4, 5)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "todo_summary",
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("open_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("completed_count", sa.Integer(), nullable=False, server_default="0"),
+        *(sa.Column(f"open_priority_{priority}", sa.Integer(), nullable=False, server_default="0") for priority in PRIORITIES)
+    )
+
+    #Counts the existing todos (hot and archived) once. Only reads the todo tables, so it does not block the application.
+    open_by_priority = ", ".join(
+        f"SUM(CASE WHEN NOT complete AND priority = {priority} THEN 1 ELSE 0 END)" for priority in PRIORITIES
+    )
+    op.execute(f"""
+        INSERT INTO todo_summary (owner_id, open_count, completed_count, {", ".join(f"open_priority_{priority}" for priority in PRIORITIES)})
+        SELECT owner_id,
+            SUM(CASE WHEN complete THEN 0 ELSE 1 END),
+            SUM(CASE WHEN complete THEN 1 ELSE 0 END),
+            {open_by_priority}
+        FROM (
+            SELECT owner_id, complete, priority FROM todos WHERE owner_id IS NOT NULL
+            UNION ALL
+            SELECT owner_id, complete, priority FROM todos_archive WHERE owner_id IS NOT NULL
+        ) AS all_todos
+        GROUP BY owner_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("todo_summary")
@@ -0,0 +1,43 @@
+"""cascade user deletes
+
+Revision ID: e8b1f4c7a2d9
+Revises: d5f0c3a9e712
+Create Date: 2026-10-19 21:34:52.716045
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from ToDoApp.online_migrations import create_index_concurrently, drop_index_concurrently, replace_foreign_key
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b1f4c7a2d9'
+down_revision = 'd5f0c3a9e712'
+branch_labels = None
+depends_on = None
+
+#(constraint name, table, column) of the foreign keys to users.user_id. The names are the Postgres defaults.
+USER_FOREIGN_KEYS = (
+    ("todos_owner_id_fkey", "todos", "owner_id"),
+    ("todos_archive_owner_id_fkey", "todos_archive", "owner_id"),
+    ("refresh_tokens_user_id_fkey", "refresh_tokens", "user_id")
+)
+
+
+def upgrade() -> None:
+    #Nullable without a default, so adding it does not rewrite the table.
+    op.add_column("users", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+
+    for name, table, column in USER_FOREIGN_KEYS:
+        replace_foreign_key(name, table, column, "users", "user_id", ondelete="CASCADE")
+
+    create_index_concurrently("ix_users_deleted_at", "users", ["deleted_at"])
+
+
+def downgrade() -> None:
+    drop_index_concurrently("ix_users_deleted_at", "users")
+
+    for name, table, column in USER_FOREIGN_KEYS:
+        replace_foreign_key(name, table, column, "users", "user_id", ondelete="NO ACTION")
+
+    op.drop_column("users", "deleted_at")
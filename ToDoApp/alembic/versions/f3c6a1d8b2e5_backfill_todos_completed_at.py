@@ -0,0 +1,28 @@
+"""backfill todos completed_at
+
+Revision ID: f3c6a1d8b2e5
+Revises: e8b1f4c7a2d9
+Create Date: 2026-10-20 09:12:31.408213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from ToDoApp.online_migrations import backfill
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c6a1d8b2e5'
+down_revision = 'e8b1f4c7a2d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    #Todos completed before completed_at was added have none, so the archive job would never move them.
+    #They count as completed now, and are archived ARCHIVE_AFTER_DAYS from now like any other completed todo.
+    backfill("todos_completed_at", "todos", "completed_at = CURRENT_TIMESTAMP", where="complete AND completed_at IS NULL", key="todo_id")
+
+
+def downgrade() -> None:
+    #The backfilled timestamps cannot be told apart from real ones, and keeping them is harmless.
+    pass
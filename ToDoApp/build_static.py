@@ -0,0 +1,111 @@
+"""
+Build step for the static assets.
+Copies every file from the static directory into the build directory together with
+- a content-hash fingerprinted copy (bootstrap.css -> bootstrap.<hash>.css)
+- precompressed gzip (.gz) and, if the brotli package is installed, brotli (.br) variants
+and writes a manifest.json mapping the original paths to the fingerprinted ones.
+
+Usage (from the repository root): python -m ToDoApp.build_static
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from . import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".html", ".svg", ".json", ".txt", ".map"}
+
+
+def fingerprint(relative_path: str, content: bytes) -> str:
+    """
+    Inserts the first 10 characters of the sha256 of the content before the file extension.
+
+    ------
+    Parameters
+    relative_path: str of the path relative to the static directory
+    content: bytes of the file content
+
+    ------
+    Returns
+    str of the fingerprinted path, e.g. todo/css/bootstrap.1a2b3c4d5e.css
+    """
+    root, extension = os.path.splitext(relative_path)
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    return f"{root}.{digest}{extension}"
+
+
+def _write(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def _write_compressed(path: str, content: bytes) -> None:
+    if os.path.splitext(path)[1] not in COMPRESSIBLE_EXTENSIONS or len(content) < MIN_COMPRESS_SIZE:
+        return
+
+    #mtime=0 makes the gzip output deterministic, so rebuilding unchanged assets gives identical files.
+    _write(path + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        _write(path + ".br", brotli.compress(content, quality=11))
+
+
+def build(source_dir: str = config.STATIC_DIR, build_dir: str = config.STATIC_BUILD_DIR) -> dict:
+    """
+    Builds the static assets from source_dir into build_dir.
+
+    ------
+    Parameters
+    source_dir: str of the directory with the original assets
+    build_dir: str of the output directory (recreated on every build)
+
+    ------
+    Returns
+    dict of the manifest (original path -> fingerprinted path)
+    """
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+
+    manifest = {}
+
+    for directory, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            source_path = os.path.join(directory, name)
+            relative_path = os.path.relpath(source_path, source_dir).replace(os.sep, "/")
+
+            with open(source_path, "rb") as file:
+                content = file.read()
+
+            hashed_path = fingerprint(relative_path, content)
+            manifest[relative_path] = hashed_path
+
+            #The original name is kept as well, for anything that is not rendered through static_url.
+            for output_path in (relative_path, hashed_path):
+                full_path = os.path.join(build_dir, output_path)
+                _write(full_path, content)
+                _write_compressed(full_path, content)
+
+    _write(os.path.join(build_dir, config.STATIC_MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the static assets")
+    parser.add_argument("--source", default=config.STATIC_DIR)
+    parser.add_argument("--output", default=config.STATIC_BUILD_DIR)
+    arguments = parser.parse_args()
+
+    built = build(arguments.source, arguments.output)
+    print(f"Built {len(built)} assets into {arguments.output} (brotli: {'yes' if brotli else 'not installed'})")
@@ -0,0 +1,264 @@
+"""
+Module for the in-process caches of the application.
+
+Every cached value is stamped with the version of the data it was built from. Versions live in a version store,
+which is process local by default or shared through Redis (REDIS_URL) when running several workers,
+so a write in one worker makes the cached copies in every other worker stale.
+"""
+
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Callable, Hashable, Union
+from . import config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry expires after ttl seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        #key -> (expires at, value). Ordered so the least recently used entry is evicted first.
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@lru_cache(maxsize=None)
+def redis_client():
+    """Returns the Redis client shared by the caches and the rate limiter of this process."""
+    if redis is None:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+
+    return redis.Redis.from_url(config.REDIS_URL)
+
+
+def _version_key(scope: Hashable) -> str:
+    if isinstance(scope, tuple):
+        return "version:" + ":".join(str(part) for part in scope)
+
+    return f"version:{scope}"
+
+
+class LocalVersionStore:
+    """Version stamps kept in this process. Correct for a single worker."""
+
+    def __init__(self) -> None:
+        self._versions: dict = {}
+        self._lock = Lock()
+
+    def get(self, scope: Hashable) -> int:
+        return self._versions.get(_version_key(scope), 0)
+
+    def incr(self, scope: Hashable) -> int:
+        key = _version_key(scope)
+
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
+
+
+class RedisVersionStore:
+    """Version stamps shared by all workers through Redis (or any Redis compatible server)."""
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    def get(self, scope: Hashable) -> int:
+        return int(self._client.get(_version_key(scope)) or 0)
+
+    def incr(self, scope: Hashable) -> int:
+        return self._client.incr(_version_key(scope))
+
+
+def make_version_store() -> Union[LocalVersionStore, RedisVersionStore]:
+    if config.REDIS_URL:
+        return RedisVersionStore(redis_client())
+
+    return LocalVersionStore()
+
+
+#Shared by every cache in the process (todo lists, rendered pages) so they are invalidated by the same writes.
+versions = make_version_store()
+
+
+def todo_as_dict(todo) -> dict:
+    """
+    Converts a ToDos model to the plain dict that is cached. Detached from the session, so it is safe to share between requests.
+    """
+    return {
+        "todo_id": todo.todo_id,
+        "title": todo.title,
+        "description": todo.description,
+        "priority": todo.priority,
+        "complete": todo.complete,
+        "owner_id": todo.owner_id
+    }
+
+
+class TodoCache:
+    """
+    Cache of every user's todo list, stamped with the ("owner", owner_id) version.
+    Writes bump the version and update the cached list in place (write-through) when no other write was missed.
+    """
+
+    def __init__(self, version_store, max_users: int, ttl: float) -> None:
+        self.versions = version_store
+        self._lists = TTLCache(max_size=max_users, ttl=ttl)
+
+    def get_or_load(self, owner_id: int, loader: Callable[[], list]) -> list:
+        """
+        Returns the owner's todos from the cache, or loads them with loader if they are missing or stale.
+
+        ------
+        Parameters
+        owner_id: int of the owner of the todos
+        loader: callable returning the todos as a list of dicts (see todo_as_dict)
+
+        ------
+        Returns
+        list of todo dicts sorted by todo_id
+        """
+        scope = ("owner", owner_id)
+
+        #The version is read before loading, so a write during the load leaves the loaded list stale instead of wrong.
+        version = self.versions.get(scope)
+        cached = self._lists.get(owner_id)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        todos = sorted(loader(), key=lambda todo: todo["todo_id"])
+        self._lists.set(owner_id, (version, todos))
+
+        return todos
+
+    def _write_through(self, owner_id: int, apply: Callable[[list], list]) -> None:
+        new_version = self.versions.incr(("owner", owner_id))
+        cached = self._lists.get(owner_id)
+
+        #Only patch the list if it is exactly one version behind, otherwise another write is missing from it.
+        if cached is not None and cached[0] == new_version - 1:
+            self._lists.set(owner_id, (new_version, apply(cached[1])))
+        else:
+            self._lists.delete(owner_id)
+
+    def invalidate(self, owner_id: int) -> None:
+        """Makes the owner's cached list (and rendered home page) stale in every worker, e.g. after a bulk change."""
+        self.versions.incr(("owner", owner_id))
+        self._lists.delete(owner_id)
+
+    def put(self, owner_id: int, todo: dict) -> None:
+        """
+        Adds or replaces a todo in the owner's cached list. To be called after the write is committed.
+
+        ------
+        Parameters
+        owner_id: int of the owner of the todo
+        todo: dict of the todo (see todo_as_dict)
+        """
+        def apply(todos: list) -> list:
+            others = [cached for cached in todos if cached["todo_id"] != todo["todo_id"]]
+            return sorted(others + [todo], key=lambda cached: cached["todo_id"])
+
+        self._write_through(owner_id, apply)
+
+    def remove(self, owner_id: int, todo_id: int) -> None:
+        """
+        Removes a todo from the owner's cached list. To be called after the delete is committed.
+
+        ------
+        Parameters
+        owner_id: int of the owner of the todo
+        todo_id: int of the deleted todo
+        """
+        self._write_through(owner_id, lambda todos: [cached for cached in todos if cached["todo_id"] != todo_id])
+
+
+todo_cache = TodoCache(versions, max_users=config.TODO_CACHE_MAX_USERS, ttl=config.CACHE_TTL_SECONDS)
+
+
+class UserCache:
+    """
+    Cache of user rows (as dicts, without the password hash), stamped with the ("user", user_id) version.
+    Users that do not exist are not cached.
+    """
+
+    def __init__(self, version_store, max_size: int, ttl: float) -> None:
+        self.versions = version_store
+        self._users = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get_or_load(self, user_id: int, loader: Callable[[], Union[dict, None]]) -> Union[dict, None]:
+        """
+        Returns the user from the cache, or loads it with loader if it is missing or stale.
+
+        ------
+        Parameters
+        user_id: int of the user
+        loader: callable returning the user as a dict, None if it does not exist
+
+        ------
+        Returns
+        dict of the user, None if the user does not exist
+        """
+        version = self.versions.get(("user", user_id))
+        cached = self._users.get(user_id)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        user = loader()
+
+        if user is not None:
+            self._users.set(user_id, (version, user))
+
+        return user
+
+    def invalidate(self, user_id: int) -> None:
+        """Makes the cached user stale in every worker. To be called after the user is changed or deleted."""
+        self.versions.incr(("user", user_id))
+        self._users.delete(user_id)
+
+
+user_cache = UserCache(versions, max_size=config.USER_CACHE_MAX_SIZE, ttl=config.USER_CACHE_TTL_SECONDS)
@@ -0,0 +1,182 @@
+"""
+Module for pushing todo changes to the open home pages (server-sent events, see GET /todos/events).
+
+Writes publish a small event per changed todo on the owner's channel, and the page patches the single row instead of
+reloading the whole list. Events go through an in-process broker by default, or through Redis pub/sub (REDIS_URL)
+so a write in one worker reaches the pages connected to every other worker.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import Union
+from .cache import redis_client
+from . import config
+
+logger = logging.getLogger(__name__)
+
+#Sent to a subscriber that fell too far behind. The page reloads instead of patching rows from an incomplete stream.
+RELOAD_EVENT = {"type": "reload"}
+
+
+class LocalSubscription:
+    def __init__(self, max_pending: int) -> None:
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+    def put(self, event: dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            #The missed events can not be replayed, so the subscriber starts over.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RELOAD_EVENT)
+
+    async def get(self, timeout: float) -> Union[dict, None]:
+        """Returns the next event, None if there was none within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    """Pub/sub within this process. Correct for a single worker."""
+
+    def __init__(self, max_pending: int = 100) -> None:
+        self.max_pending = max_pending
+        self._subscriptions: defaultdict = defaultdict(set)
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._lock = Lock()
+
+    def publish(self, channel: str, event: dict) -> None:
+        """
+        Delivers the event to the subscribers of the channel. Safe to call from the threads running the maintenance jobs.
+
+        ------
+        Parameters
+        channel: str of the channel, e.g. "todos:1"
+        event: json serializable dict of the event
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+
+        if not subscriptions:
+            return
+
+        def deliver() -> None:
+            for subscription in subscriptions:
+                subscription.put(event)
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            deliver()
+        else:
+            self._loop.call_soon_threadsafe(deliver)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        self._loop = asyncio.get_running_loop()
+        subscription = LocalSubscription(self.max_pending)
+
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub) -> None:
+        self.pubsub = pubsub
+
+    async def get(self, timeout: float) -> Union[dict, None]:
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message["data"]) if message else None
+
+
+class RedisBroker:
+    """Pub/sub shared by all workers through Redis (or any Redis compatible server)."""
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    def publish(self, channel: str, event: dict) -> None:
+        self._client.publish(f"events:{channel}", json.dumps(event))
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        import redis.asyncio
+
+        #Every subscriber holds its own connection for as long as the page is open.
+        client = redis.asyncio.Redis.from_url(config.REDIS_URL)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(f"events:{channel}")
+
+        try:
+            yield RedisSubscription(pubsub)
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+            await client.close()
+
+
+def make_broker() -> Union[LocalBroker, RedisBroker]:
+    if config.REDIS_URL:
+        return RedisBroker(redis_client())
+
+    return LocalBroker()
+
+
+broker = make_broker()
+
+
+def owner_channel(owner_id: int) -> str:
+    return f"todos:{owner_id}"
+
+
+def publish_todo(todo: dict) -> None:
+    """
+    Publishes that a todo was created or changed. To be called after the write is committed.
+
+    ------
+    Parameters
+    todo: dict of the todo (see cache.todo_as_dict)
+    """
+    try:
+        broker.publish(owner_channel(todo["owner_id"]), {"type": "upsert", "todo": todo})
+    except Exception:
+        #The pages fall back to reloading, a failed push must not fail the write.
+        logger.exception("Could not publish the change of todo %s", todo["todo_id"])
+
+
+def publish_todo_removed(owner_id: int, todo_id: int) -> None:
+    """
+    Publishes that a todo left the owner's list (deleted or archived). To be called after the write is committed.
+
+    ------
+    Parameters
+    owner_id: int of the owner of the todo
+    todo_id: int of the removed todo
+    """
+    try:
+        broker.publish(owner_channel(owner_id), {"type": "remove", "todo_id": todo_id})
+    except Exception:
+        logger.exception("Could not publish the removal of todo %s", todo_id)
+
+
+def format_event(event: dict) -> str:
+    """Formats the event as a server-sent event."""
+    return f"event: todo\ndata: {json.dumps(event)}\n\n"
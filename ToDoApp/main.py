@@ -1,22 +1,105 @@
+"""
+The todo application. Run it from the repository root:
+    uvicorn ToDoApp.main:todo_api
+or let every worker build its own application with the factory:
+    uvicorn --factory ToDoApp.main:create_app
+
+Nothing heavy happens at import: the database engine, the password hashing and the templates are set up on first use,
+and the tables are created, the templates compiled and the background tasks started by the lifespan of the application.
+"""
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from database import engine
-from routers import auth, todos, users, address
-from starlette.staticfiles import StaticFiles
-import models
+from fast_responses import FastJSONResponse, CompressionMiddleware
+from .database import RecentWriteMiddleware, get_engine
+from .routers import auth, todos, users, address, ops
+from .static_files import PrecompressedStaticFiles, static_directory
+from .templating import precompile_templates
+from .rate_limit import LoginRateLimitMiddleware
+from .admission import AdmissionControlMiddleware
+from .write_behind import write_behind
+from .scheduler import scheduler, parse_hours
+from . import maintenance
+from . import account_deletion
+from . import config
+from . import models
+
+
+def add_maintenance_jobs() -> None:
+    """Maintenance jobs. They run in small batches within a time budget, and only within MAINTENANCE_HOURS if it is set."""
+    maintenance_hours = parse_hours(config.MAINTENANCE_HOURS)
+    scheduler.add("purge_orphan_addresses", maintenance.sweep_orphan_addresses, config.ORPHAN_SWEEP_INTERVAL_SECONDS, hours=maintenance_hours)
+    scheduler.add("archive_completed_todos", maintenance.archive_completed_todos, config.ARCHIVE_INTERVAL_SECONDS, batch_size=500, hours=maintenance_hours)
+    scheduler.add("analyze_tables", maintenance.analyze_tables, config.ANALYZE_INTERVAL_SECONDS)
+    scheduler.add("reconcile_todo_summaries", maintenance.reconcile_todo_summaries, config.SUMMARY_RECONCILE_INTERVAL_SECONDS, batch_size=200, hours=maintenance_hours)
+    #Deleting accounts is not deferred to the maintenance hours, the user asked for it.
+    scheduler.add("purge_deleted_users", account_deletion.purge_deleted_users, config.DELETED_USERS_PURGE_INTERVAL_SECONDS, batch_size=1000)
+    scheduler.add("check_replicas", maintenance.check_replicas, config.REPLICA_CHECK_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    #Creating the database and the respective tables if it does not exist.
+    models.Base.metadata.create_all(bind=get_engine())
+
+    #Compiles the templates before the worker starts serving, so the first page views do not pay for it.
+    precompile_templates()
+
+    #Starts the write-behind queue (and replays writes left uncommitted by a previous run).
+    if config.WRITE_BEHIND:
+        await write_behind.start()
+
+    scheduler.start()
+
+    try:
+        yield
+
+    finally:
+        scheduler.stop()
+        #Commits every queued write before the worker exits.
+        await write_behind.stop()
+
+
+def create_app() -> FastAPI:
+    """
+    Builds the todo application: middlewares, static files, routers and the lifespan.
+
+    ------
+    Returns
+    FastAPI application
+    """
+    #Setting up the main api relay.
+    app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+
+    #Compresses json and html responses above the size threshold. The static files are already precompressed,
+    #and the event stream must reach the browser event by event instead of being buffered by the compressor.
+    app.add_middleware(CompressionMiddleware, exclude_prefixes=("/static", "/todos/events"))
+
+    #Throttles the login endpoints per client ip before any database or bcrypt work is done.
+    app.add_middleware(LoginRateLimitMiddleware)
+
+    #Keeps a client's reads on the primary for a moment after it wrote, so it does not read stale rows from a lagging replica.
+    #The delete and complete actions of the todos are GET requests.
+    app.add_middleware(RecentWriteMiddleware, write_paths=("/todos/delete/", "/todos/complete/"))
+
+    #Limits the requests served at once (adapted to their latency), queueing or rejecting the rest with a fast 503 when the
+    #database slows down. Added last, so it runs first. The event stream stays open for as long as the page, so it is not limited.
+    app.add_middleware(AdmissionControlMiddleware, exclude_prefixes=("/static", "/todos/events"))
 
+    #Adding static files to our application (sub-application) via application mounting.
+    #Serves the fingerprinted and precompressed build (python -m ToDoApp.build_static) if it exists.
+    app.mount("/static", PrecompressedStaticFiles(directory=static_directory()), name="static")
 
-#Setting up the main api relay.
-todo_api = FastAPI()
+    #Routers for the different APIs
+    app.include_router(auth.router)
+    app.include_router(todos.router)
+    app.include_router(users.router)
+    app.include_router(address.router)
+    app.include_router(ops.router)
 
-#Creating the database and the respective tables if it does not exist.
-models.Base.metadata.create_all(bind=engine)
+    add_maintenance_jobs()
 
-#Adding static files to our application (sub-application) via application mounting
+    return app
 
-todo_api.mount("/static", StaticFiles(directory="static"), name="static")
 
-#Routers for the different APIs
-todo_api.include_router(auth.router)
-todo_api.include_router(todos.router)
-todo_api.include_router(users.router)
-todo_api.include_router(address.router)
+todo_api = create_app()
@@ -0,0 +1,195 @@
+"""
+Module for the maintenance jobs of the database, run by the scheduler (see scheduler.py).
+Every job has the signature job(db, batch_size) -> int: it processes at most batch_size rows, commits,
+and returns how many rows it processed.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, insert, literal, select, text
+from .cache import todo_cache, versions
+from .database import replicas
+from .events import publish_todo_removed
+from . import config
+from . import models
+from . import todo_summary
+
+logger = logging.getLogger(__name__)
+
+#Deletes a batch of addresses that no user links to (left behind by older versions of create_address).
+#Addresses are only ever linked right after being inserted in the same transaction, so a committed orphan is never re-linked.
+DELETE_ORPHAN_ADDRESSES_SQL = text("""
+    DELETE FROM address
+    WHERE id IN (
+        SELECT address.id FROM address
+        WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.address_id = address.id)
+        LIMIT :batch_size
+    )
+""")
+
+#The tables checked by the analyze job
+TABLES = ("users", "todos", "todos_archive", "address", "refresh_tokens", "todo_summary")
+
+TABLE_STATS_SQL = text("""
+    SELECT relname, n_live_tup, n_dead_tup, n_mod_since_analyze
+    FROM pg_stat_user_tables
+    WHERE relname IN :tables
+""").bindparams(bindparam("tables", expanding=True))
+
+
+def sweep_orphan_addresses(db, batch_size: int = 1000) -> int:
+    """
+    Deletes up to batch_size orphaned addresses and commits.
+
+    ------
+    Parameters
+    db: the database session
+    batch_size: int of the max number of rows deleted in one transaction, which keeps the locks short
+
+    ------
+    Returns
+    int of the number of deleted addresses
+    """
+    deleted = db.execute(DELETE_ORPHAN_ADDRESSES_SQL, {"batch_size": batch_size}).rowcount
+    db.commit()
+
+    return deleted
+
+
+def archive_completed_todos(db, batch_size: int = 1000) -> int:
+    """
+    Moves up to batch_size todos completed more than ARCHIVE_AFTER_DAYS ago from todos to todos_archive and commits.
+
+    ------
+    Parameters
+    db: the database session
+    batch_size: int of the max number of todos moved in one transaction
+
+    ------
+    Returns
+    int of the number of archived todos
+    """
+    cutoff = datetime.utcnow() - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+    archivable = (models.ToDos.complete == True, models.ToDos.completed_at < cutoff)
+
+    #The candidates are locked until the commit, so a todo un-completed or edited meanwhile is neither archived with stale
+    #data nor changed after it was copied. Rows locked by a running write are skipped until the next run. (sqlite ignores
+    #the lock, its single writer holds the write lock for the whole transaction.)
+    rows = db.execute(
+        select(models.ToDos.todo_id, models.ToDos.owner_id)
+        .where(*archivable)
+        .order_by(models.ToDos.todo_id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    if not rows:
+        return 0
+
+    todo_ids = [row.todo_id for row in rows]
+    columns = ("todo_id", "title", "description", "priority", "complete", "completed_at", "owner_id")
+
+    db.execute(
+        insert(models.TodosArchive).from_select(
+            columns + ("archived_at",),
+            select(*(getattr(models.ToDos, column) for column in columns), literal(datetime.utcnow()))
+            .where(models.ToDos.todo_id.in_(todo_ids), *archivable)
+        )
+    )
+    db.execute(delete(models.ToDos).where(models.ToDos.todo_id.in_(todo_ids), *archivable).execution_options(synchronize_session=False))
+    db.commit()
+
+    #The archived todos left the owners' hot lists, so their cached lists and pages are stale.
+    for owner_id in {row.owner_id for row in rows}:
+        todo_cache.invalidate(owner_id)
+    for row in rows:
+        versions.incr(("todo", row.todo_id))
+        publish_todo_removed(row.owner_id, row.todo_id)
+
+    return len(rows)
+
+
+#The last user reconciled by reconcile_todo_summaries, so every run continues with the next users.
+_reconcile_cursor = {"user_id": 0}
+
+
+def reconcile_todo_summaries(db, batch_size: int = 1000) -> int:
+    """
+    Recounts the todo counters of the next batch_size users (see todo_summary.py), corrects the ones that drifted and commits.
+    Starts over with the first user once every user was reconciled.
+
+    ------
+    Returns
+    int of the number of reconciled users
+    """
+    user_ids = db.execute(
+        select(models.Users.user_id)
+        .where(models.Users.user_id > _reconcile_cursor["user_id"])
+        .order_by(models.Users.user_id)
+        .limit(batch_size)
+    ).scalars().all()
+
+    _reconcile_cursor["user_id"] = user_ids[-1] if len(user_ids) == batch_size else 0
+
+    if not user_ids:
+        return 0
+
+    corrected = todo_summary.reconcile(db, user_ids)
+
+    if corrected:
+        logger.warning("Corrected the todo counters of %d users", corrected)
+
+    return len(user_ids)
+
+
+def analyze_tables(db, batch_size: int = 1000) -> int:
+    """
+    Refreshes the planner statistics of the tables that changed a lot since they were last analyzed,
+    and logs a hint for the tables with many dead rows (VACUUM can not run inside a transaction, so it is left to autovacuum or an operator).
+    On SQLite it runs PRAGMA optimize instead.
+
+    ------
+    Returns
+    int of the number of analyzed tables
+    """
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        db.execute(text("PRAGMA optimize"))
+        return 0
+
+    if dialect != "postgresql":
+        return 0
+
+    analyzed = 0
+
+    for table in db.execute(TABLE_STATS_SQL, {"tables": list(TABLES)}).all():
+        live = max(table.n_live_tup, 1)
+
+        if table.n_dead_tup / live > config.VACUUM_HINT_DEAD_RATIO:
+            logger.warning("Table %s has %d dead rows (%d live), VACUUM recommended", table.relname, table.n_dead_tup, table.n_live_tup)
+
+        if table.n_mod_since_analyze / live > config.ANALYZE_MODIFIED_RATIO:
+            #The name comes from the TABLES constant, never from input.
+            db.execute(text(f"ANALYZE {table.relname}"))
+            analyzed += 1
+
+    db.commit()
+
+    return analyzed
+
+
+def check_replicas(db, batch_size: int = 1000) -> int:
+    """
+    Checks the health and lag of the read replicas. Unhealthy or lagging replicas stop serving reads until they recover.
+
+    ------
+    Returns
+    0, as no rows are processed
+    """
+    healthy = replicas.check()
+
+    if replicas.engines and not healthy:
+        logger.warning("No healthy read replica, reads go to the primary")
+
+    return 0
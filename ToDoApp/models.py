@@ -3,9 +3,9 @@ Module for setting up the models of the application.
 The classes below define the tables in the database
 """
 
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
-from database import Base
+from .database import Base
 
 
 #Setting up the database tables
@@ -23,10 +23,14 @@ class Users(Base):
     is_active = Column(Boolean, default=True)
     phone_number = Column(String)
     #Setting up table connection where address.id is Primary Key and users.address_id is foreign key
-    address_id = Column(Integer, ForeignKey("address.id"), nullable=True)
+    #Indexed so addresses no longer linked to a user can be found without scanning the users table.
+    address_id = Column(Integer, ForeignKey("address.id"), nullable=True, index=True)
+    #Set when the deletion of a large account was started, the rows are then deleted in chunks by a maintenance job.
+    deleted_at = Column(DateTime, nullable=True, index=True)
 
     #Setting up a connection between primary key here -> foreign key.
-    todos = relationship("ToDos", back_populates="owner")
+    #The database deletes the todos with their user (ON DELETE CASCADE), so the ORM never loads them to delete them.
+    todos = relationship("ToDos", back_populates="owner", passive_deletes=True)
     address = relationship("Address", back_populates="user_address")
 
 class ToDos(Base):
@@ -38,12 +42,29 @@ class ToDos(Base):
     description = Column(String)
     priority = Column(Integer)
     complete = Column(Boolean, default=False)
-    owner_id = Column(Integer, ForeignKey("users.user_id"))
+    #When the todo was completed (None while it is open). Completed todos are moved to todos_archive after a while.
+    completed_at = Column(DateTime, nullable=True, index=True)
+    #Indexed so a user's (hot) todos are read without scanning the table.
+    owner_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), index=True)
 
     #Connection between Users.user_id and ToDos.owner (foreign key)
     owner = relationship("Users", back_populates="todos")
 
 
+class TodosArchive(Base):
+    #The table name. Cold storage of completed todos, moved here by the archive maintenance job.
+    __tablename__ = "todos_archive"
+
+    todo_id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
+    priority = Column(Integer)
+    complete = Column(Boolean, default=True)
+    completed_at = Column(DateTime, nullable=True)
+    owner_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), index=True)
+    archived_at = Column(DateTime, nullable=False)
+
+
 class Address(Base):
     #The table name
     __tablename__ = "address"
@@ -58,3 +79,33 @@ class Address(Base):
     apt_num = Column(String)
 
     user_address = relationship("Users", back_populates="address")
+
+
+class RefreshTokens(Base):
+    #The table name
+    __tablename__ = "refresh_tokens"
+
+    #Only the random id (jti) of the token is stored, the token itself is a signed jwt held by the browser.
+    token_id = Column(String(32), primary_key=True)
+    #Indexed so every token of a user can be revoked at once (e.g. on password change).
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), index=True, nullable=False)
+    #All tokens rotated from the same login share the family id, so a reused (stolen) token revokes the whole chain.
+    family_id = Column(String(32), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked = Column(Boolean, default=False, nullable=False)
+
+
+class TodoSummary(Base):
+    #The table name. Counters of every user's todos (the hot and the archived ones), so showing them is one primary key lookup.
+    #Kept up to date by the todo write paths (see todo_summary.py) and corrected by the reconciliation job.
+    __tablename__ = "todo_summary"
+
+    owner_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    open_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    #Open todos by priority (1 to 5)
+    open_priority_1 = Column(Integer, nullable=False, default=0)
+    open_priority_2 = Column(Integer, nullable=False, default=0)
+    open_priority_3 = Column(Integer, nullable=False, default=0)
+    open_priority_4 = Column(Integer, nullable=False, default=0)
+    open_priority_5 = Column(Integer, nullable=False, default=0)
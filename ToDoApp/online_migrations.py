@@ -0,0 +1,239 @@
+"""
+Helpers for migrations that run while the application is serving (see alembic/versions).
+
+Plain DDL takes locks that block every read and write of the table for as long as the statement runs, which on the
+large users and todos tables is minutes. With these helpers:
+- indexes are built with CREATE INDEX CONCURRENTLY, outside of the migration transaction
+- the migration statements give up after a lock or statement timeout instead of queueing every request behind them
+- data is moved in small batches, each in its own transaction, and a backfill that was interrupted resumes where it stopped
+
+On SQLite (local development) they fall back to the plain operations.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Sequence, Union
+from alembic import op
+from sqlalchemy import text
+from . import config
+
+logger = logging.getLogger("alembic.online_migrations")
+
+#Progress of the batched backfills, so an interrupted backfill continues after the last committed batch.
+PROGRESS_TABLE = "online_migration_progress"
+
+
+def _is_postgres() -> bool:
+    return op.get_bind().dialect.name == "postgresql"
+
+
+def set_timeouts(lock_timeout: str = config.MIGRATION_LOCK_TIMEOUT, statement_timeout: str = config.MIGRATION_STATEMENT_TIMEOUT) -> None:
+    """
+    Changes the lock and statement timeouts of the migration connection (Postgres only).
+    env.py sets the defaults (MIGRATION_LOCK_TIMEOUT, MIGRATION_STATEMENT_TIMEOUT), a migration may need others.
+
+    ------
+    Parameters
+    lock_timeout: str of the longest wait for a lock, e.g. "5s". A migration waiting for a lock blocks every query queued after it.
+    statement_timeout: str of the longest statement, e.g. "60s". "0" disables it.
+    """
+    if not _is_postgres():
+        return
+
+    op.execute(text("SELECT set_config('lock_timeout', :lock_timeout, false), set_config('statement_timeout', :statement_timeout, false)")
+               .bindparams(lock_timeout=lock_timeout, statement_timeout=statement_timeout))
+
+
+@contextmanager
+def no_statement_timeout():
+    """Lifts the statement timeout for long running statements that do not block others, like concurrent index builds."""
+    if not _is_postgres():
+        yield
+        return
+
+    previous = op.get_bind().exec_driver_sql("SHOW statement_timeout").scalar()
+    op.execute("SET statement_timeout = 0")
+
+    try:
+        yield
+    finally:
+        op.execute(text("SELECT set_config('statement_timeout', :previous, false)").bindparams(previous=previous))
+
+
+def _drop_invalid_index(name: str) -> None:
+    #A concurrent build that failed leaves an invalid index behind, which would make the retry a no-op.
+    invalid = op.get_bind().execute(text("""
+        SELECT 1 FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+    """), {"name": name}).first()
+
+    if invalid:
+        logger.warning("Dropping the invalid index %s left by a failed build", name)
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def create_index_concurrently(name: str, table: str, columns: Sequence[str], unique: bool = False, where: Union[str, None] = None) -> None:
+    """
+    Creates the index without blocking writes to the table. On Postgres it runs outside of the migration transaction,
+    and is skipped if a valid index with that name exists, so a failed migration can simply be run again.
+
+    ------
+    Parameters
+    name: str of the index name
+    table: str of the table name
+    columns: the indexed column names
+    unique: bool if the index is unique
+    where: str of the predicate of a partial index
+    """
+    if not _is_postgres():
+        op.create_index(name, table, list(columns), unique=unique, sqlite_where=text(where) if where else None)
+        return
+
+    with op.get_context().autocommit_block(), no_statement_timeout():
+        _drop_invalid_index(name)
+        op.execute(
+            f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" '
+            f'({", ".join(columns)}){f" WHERE {where}" if where else ""}'
+        )
+
+
+def drop_index_concurrently(name: str, table: str) -> None:
+    """Drops the index without blocking reads and writes of the table (Postgres), outside of the migration transaction."""
+    if not _is_postgres():
+        op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block(), no_statement_timeout():
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def replace_foreign_key(name: str, table: str, column: str, referred_table: str, referred_column: str, ondelete: str) -> None:
+    """
+    Replaces the foreign key of the column with one having the given ON DELETE action (Postgres only, SQLite can not alter
+    constraints). The new constraint is added NOT VALID, which only takes a short lock, and validated afterwards outside
+    of the migration transaction, which scans the table without blocking writes.
+
+    ------
+    Parameters
+    name: str of the name of the (existing and new) constraint, e.g. "todos_owner_id_fkey"
+    table: str of the table with the foreign key
+    column: str of the foreign key column
+    referred_table: str of the referred table
+    referred_column: str of the referred column
+    ondelete: str of the action, "CASCADE" or "SET NULL"
+    """
+    if not _is_postgres():
+        return
+
+    op.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT IF EXISTS "{name}"')
+    op.execute(
+        f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ("{column}") '
+        f'REFERENCES "{referred_table}" ("{referred_column}") ON DELETE {ondelete} NOT VALID'
+    )
+
+    with op.get_context().autocommit_block(), no_statement_timeout():
+        op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{name}"')
+
+
+def _ensure_progress_table(connection) -> None:
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+            name VARCHAR PRIMARY KEY,
+            last_key BIGINT NOT NULL,
+            processed BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """))
+
+
+def backfill(name: str,
+             table: str,
+             set_sql: str,
+             where: str = "TRUE",
+             key: str = "id",
+             batch_size: int = config.MIGRATION_BATCH_SIZE,
+             pause: float = config.MIGRATION_BATCH_PAUSE_SECONDS,
+             params: Union[dict, None] = None) -> int:
+    """
+    Updates the rows matching where in batches of batch_size, walking the table by its key. Every batch is committed
+    on its own, so locks are held for one short batch only, and the progress is saved with it: if the migration is
+    interrupted, running it again continues after the last committed batch. The progress is logged after every batch.
+
+    The statements are built from the arguments of the migration, never from input.
+
+    ------
+    Parameters
+    name: str unique name of the backfill, e.g. "todos_completed_at"
+    table: str of the table name
+    set_sql: str of the SET clause, e.g. "completed_at = now()"
+    where: str of the predicate selecting the rows to update, e.g. "complete AND completed_at IS NULL"
+    key: str of the integer, unique and indexed column the table is walked by
+    batch_size: int of the rows updated per transaction
+    pause: float of the seconds slept between the batches, which gives room to the other transactions and to replication
+    params: dict of the bound parameters used in set_sql or where
+
+    ------
+    Returns
+    int of the number of updated rows (in this run)
+    """
+    params = params or {}
+    update_sql = text(f"""
+        UPDATE {table} SET {set_sql}
+        WHERE {key} > :last_key AND {key} <= :max_key AND ({where})
+    """)
+    next_key_sql = text(f"""
+        SELECT MAX({key}) FROM (
+            SELECT {key} FROM {table} WHERE {key} > :last_key ORDER BY {key} LIMIT :batch_size
+        ) AS batch
+    """)
+    save_progress_sql = text(f"""
+        INSERT INTO {PROGRESS_TABLE} (name, last_key, processed, updated_at) VALUES (:name, :last_key, :processed, CURRENT_TIMESTAMP)
+    """)
+
+    #The batches run on their own connection, so every batch is committed independently of the migration transaction.
+    #The backfill should be in a migration of its own, so that transaction holds no lock on the table.
+    engine = op.get_bind().engine
+
+    with engine.begin() as connection:
+        _ensure_progress_table(connection)
+        #Rows inserted after the backfill started are expected to be written in the new shape by the application.
+        end_key = connection.execute(text(f"SELECT MAX({key}) FROM {table}")).scalar() or 0
+        progress = connection.execute(text(f"SELECT last_key, processed FROM {PROGRESS_TABLE} WHERE name = :name"), {"name": name}).first()
+
+    last_key, total = (progress.last_key, progress.processed) if progress else (0, 0)
+
+    if progress:
+        logger.info("Resuming backfill %s of %s after %s = %d (%d rows done)", name, table, key, last_key, total)
+
+    started = time.monotonic()
+    updated = 0
+
+    while last_key < end_key:
+        #One transaction per batch: the update and the saved progress are committed together.
+        with engine.begin() as connection:
+            if _is_postgres():
+                connection.execute(text("SELECT set_config('lock_timeout', :lock_timeout, true)"), {"lock_timeout": config.MIGRATION_LOCK_TIMEOUT})
+
+            next_key = min(connection.execute(next_key_sql, {"last_key": last_key, "batch_size": batch_size}).scalar() or end_key, end_key)
+            batch = connection.execute(update_sql, {**params, "last_key": last_key, "max_key": next_key}).rowcount
+
+            connection.execute(text(f"DELETE FROM {PROGRESS_TABLE} WHERE name = :name"), {"name": name})
+            connection.execute(save_progress_sql, {"name": name, "last_key": next_key, "processed": total + batch})
+
+        last_key = next_key
+        updated += batch
+        total += batch
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            "Backfill %s of %s: %s %d of %d, %d rows updated (%.0f rows/s)",
+            name, table, key, last_key, end_key, total, updated / elapsed if elapsed else 0.0
+        )
+
+        time.sleep(pause)
+
+    logger.info("Backfill %s of %s done, %d rows updated", name, table, total)
+
+    return updated
@@ -0,0 +1,168 @@
+"""
+Module for throttling the login endpoints with token buckets.
+
+Every key (client ip or username) has a bucket of "burst" tokens that refills at a fixed rate, and every attempt takes a token.
+Buckets are kept in this process by default, or in Redis (REDIS_URL) so all workers share them.
+Attempts are rejected before the database is queried or any password is verified with bcrypt.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Tuple, Union
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from .cache import redis_client
+from . import config
+
+#The login endpoints, throttled per client ip by the middleware.
+LOGIN_PATHS = ("/auth", "/auth/", "/auth/token", "/auth/token/")
+
+
+class LocalBucketStore:
+    """
+    Token buckets kept in this process. Each bucket is a (tokens, updated at) tuple,
+    and at most max_keys buckets are kept - the least recently used one is dropped first.
+    """
+
+    def __init__(self, max_keys: int = 100000) -> None:
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key: str, burst: int, rate: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, tokens
+
+
+#Refill and take in one atomic step on the Redis server. The key expires once the bucket would be full again.
+TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by all workers through Redis (or any Redis compatible server)."""
+
+    def __init__(self, client) -> None:
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key: str, burst: int, rate: float) -> Tuple[bool, float]:
+        allowed, tokens = self._take(keys=[f"ratelimit:{key}"], args=[burst, rate, time.time()])
+        return bool(allowed), float(tokens)
+
+
+class RateLimiter:
+    def __init__(self, store, burst: int, per_minute: float) -> None:
+        self.store = store
+        self.burst = burst
+        self.rate = per_minute / 60
+
+    def hit(self, key: str) -> Union[float, None]:
+        """
+        Takes a token from the bucket of the key.
+
+        ------
+        Parameters
+        key: str of the bucket key, e.g. "ip:127.0.0.1"
+
+        ------
+        Returns
+        None if the attempt is allowed, otherwise the number of seconds until the next token is available
+        """
+        allowed, tokens = self.store.take(key, self.burst, self.rate)
+
+        if allowed:
+            return None
+
+        return (1 - tokens) / self.rate
+
+
+def make_bucket_store() -> Union[LocalBucketStore, RedisBucketStore]:
+    if config.REDIS_URL:
+        return RedisBucketStore(redis_client())
+
+    return LocalBucketStore()
+
+
+bucket_store = make_bucket_store()
+ip_limiter = RateLimiter(bucket_store, burst=config.LOGIN_IP_BURST, per_minute=config.LOGIN_IP_PER_MINUTE)
+username_limiter = RateLimiter(bucket_store, burst=config.LOGIN_USERNAME_BURST, per_minute=config.LOGIN_USERNAME_PER_MINUTE)
+
+
+def too_many_attempts_exception(retry_after: float):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts",
+        headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+
+def check_username_limit(username: Union[str, None]) -> None:
+    """
+    Raises a 429 exception if the username has run out of login attempts.
+    To be called before the user is looked up, so throttled attempts cost neither a query nor a bcrypt verify.
+
+    ------
+    Parameters
+    username: str of the username from the login form
+    """
+    retry_after = username_limiter.hit(f"username:{(username or '').lower()}")
+
+    if retry_after is not None:
+        raise too_many_attempts_exception(retry_after)
+
+
+class LoginRateLimitMiddleware:
+    """
+    ASGI middleware throttling POST requests to the login endpoints per client ip.
+    Runs before the request body is read, so rejected requests never reach the routers.
+    """
+
+    def __init__(self, app: ASGIApp, paths: tuple = LOGIN_PATHS) -> None:
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            client = scope.get("client")
+            retry_after = ip_limiter.hit(f"ip:{client[0] if client else 'unknown'}")
+
+            if retry_after is not None:
+                exception = too_many_attempts_exception(retry_after)
+                response = JSONResponse({"detail": exception.detail}, status_code=exception.status_code, headers=exception.headers)
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,87 @@
+"""
+Module for caching rendered Jinja2 templates.
+Static pages are rendered once and served as bytes. Pages that depend on data are cached per "scope"
+(e.g. ("owner", 1) or ("todo", 5)) and are invalidated by bumping the version of that scope on writes.
+The versions are kept in the version store from cache.py, so a write in one worker invalidates the pages in all of them.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable, Union
+from fastapi import Request
+from fastapi.responses import HTMLResponse
+
+
+class RenderCache:
+    def __init__(self, get_templates: Callable, version_store, max_entries: int = 1024) -> None:
+        #Returns the Jinja2Templates, which are only set up when the first page is rendered.
+        self.get_templates = get_templates
+        #scope -> version. Bumped every time data within the scope is written.
+        self.versions = version_store
+        self.max_entries = max_entries
+        #(name, base_url, scope) -> (scope version, rendered bytes). Ordered so the least recently used page is evicted first.
+        self._pages: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def version(self, scope: Hashable) -> int:
+        #Static pages never change, so the version store is not asked for them.
+        if scope is None:
+            return 0
+
+        return self.versions.get(scope)
+
+    def invalidate(self, *scopes: Hashable) -> None:
+        """
+        Bumps the version of the given scopes so every cached page rendered for them is re-rendered on the next request.
+
+        ------
+        Parameters
+        scopes: the scopes that were written to, e.g. ("owner", owner_id) and ("todo", todo_id)
+        """
+        for scope in scopes:
+            self.versions.incr(scope)
+
+    def page(self,
+             request: Request,
+             name: str,
+             scope: Union[Hashable, None] = None,
+             context_factory: Union[Callable[[], dict], None] = None) -> HTMLResponse:
+        """
+        Returns the rendered template, rendering it only if it is not cached for the current version of the scope.
+        The context factory is only called on a cache miss, so the database is not queried for cached pages.
+
+        ------
+        Parameters
+        request: the incoming request (needed by url_for inside the templates)
+        name: str of the template name
+        scope: the data scope of the page. None for pages that do not depend on any data (rendered once).
+        context_factory: callable returning the template context on a cache miss
+
+        ------
+        Returns
+        HTMLResponse with the rendered page
+        """
+
+        #url_for in the templates renders absolute urls, so the base url is part of the key.
+        key = (name, str(request.base_url), scope)
+
+        #The version has to be read before the data is fetched, so a write during the render makes the page stale right away.
+        version = self.version(scope)
+
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is not None and cached[0] == version:
+                self._pages.move_to_end(key)
+                return HTMLResponse(content=cached[1])
+
+        context = context_factory() if context_factory else {}
+        context["request"] = request
+        content = self.get_templates().get_template(name).render(context).encode("utf-8")
+
+        with self._lock:
+            self._pages[key] = (version, content)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+        return HTMLResponse(content=content)
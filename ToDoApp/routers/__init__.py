@@ -0,0 +1,3 @@
+"""
+The routers of the todo application, included by main.create_app.
+"""
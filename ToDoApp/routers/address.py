@@ -1,13 +1,13 @@
-import sys
-sys.path.append("...")
-
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Response, status
 from typing import Union
-from database import engine, SessionLocal
+from ..database import SessionLocal
+from sqlalchemy import insert, select, text, update
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from routers.auth import get_current_user, get_user_exception
-import models
+from .auth import get_current_user, get_user_exception
+from ..write_behind import write_behind
+from ..cache import user_cache
+from .. import models
 
 
 router = APIRouter(
@@ -35,34 +35,100 @@ class Address(BaseModel):
     postalcode: str
 
 
+ADDRESS_FIELDS = ("address1", "address2", "city", "state", "country", "postalcode", "apt_num")
+
+#Updates the user's linked address in place, or inserts a new one and links it if the user has none - in one round-trip.
+#Returns the id of the address. Nothing is inserted for a user that does not exist.
+UPSERT_ADDRESS_SQL = text("""
+    WITH linked AS (
+        UPDATE address
+        SET address1 = :address1, address2 = :address2, city = :city, state = :state,
+            country = :country, postalcode = :postalcode, apt_num = :apt_num
+        FROM users
+        WHERE users.user_id = :user_id AND address.id = users.address_id
+        RETURNING address.id
+    ), inserted AS (
+        INSERT INTO address (address1, address2, city, state, country, postalcode, apt_num)
+        SELECT :address1, :address2, :city, :state, :country, :postalcode, :apt_num
+        WHERE NOT EXISTS (SELECT 1 FROM linked)
+        AND EXISTS (SELECT 1 FROM users WHERE user_id = :user_id)
+        RETURNING id
+    ), relinked AS (
+        UPDATE users SET address_id = inserted.id
+        FROM inserted
+        WHERE users.user_id = :user_id
+        RETURNING users.address_id
+    )
+    SELECT id FROM linked
+    UNION ALL
+    SELECT address_id FROM relinked
+""")
+
+
+def save_address(db, user_id: int, address: dict) -> Union[int, None]:
+    """
+    Upserts the address of the user: the address already linked to the user is updated, otherwise a new one is inserted and linked.
+    The caller commits.
+
+    ------
+    Parameters
+    db: the database session
+    user_id: int of the user
+    address: dict of the Address body
+
+    ------
+    Returns
+    int of the address id, None if the user does not exist
+    """
+    values = {field: address.get(field) for field in ADDRESS_FIELDS}
+
+    #Postgres does it all in one statement with data-modifying CTEs.
+    if db.get_bind().dialect.name == "postgresql":
+        return db.execute(UPSERT_ADDRESS_SQL, {**values, "user_id": user_id}).scalar()
+
+    #Other databases: one lookup of the linked address id, then an update or an insert and link.
+    address_id = db.execute(select(models.Users.address_id).where(models.Users.user_id == user_id)).first()
+
+    if address_id is None:
+        return None
+
+    if address_id[0] is not None:
+        db.execute(update(models.Address).where(models.Address.id == address_id[0]).values(**values))
+        return address_id[0]
+
+    new_address_id = db.execute(insert(models.Address).values(**values)).inserted_primary_key[0]
+    db.execute(update(models.Users).where(models.Users.user_id == user_id).values(address_id=new_address_id))
+
+    return new_address_id
+
+
+#In write-behind mode only the last address update of a user within a batch is applied.
+#The user's address_id may have changed, so the cached user is invalidated.
+write_behind.register(
+    "set_address",
+    lambda db, payload: save_address(db, payload["user_id"], payload["address"]),
+    key=lambda payload: payload["user_id"],
+    after_commit=lambda payload: user_cache.invalidate(payload["user_id"])
+)
+
+
 @router.post("/")
-async def create_address(address: Address, user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_address(response: Response, address: Address, user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
 
     if user is None:
         raise get_user_exception()
 
-    address_model = models.Address()
-
-    address_model.address1 = address.address1
-    address_model.address2 = address.address2
-    address_model.city = address.city
-    address_model.state = address.state
-    address_model.country = address.country
-    address_model.postalcode = address.postalcode
-    address_model.apt_num = address.apt_num
+    #Queued and committed in a batch by the background task.
+    if write_behind.running:
+        write_behind.enqueue("set_address", {"user_id": user.get("user_id"), "address": address.dict()})
+        response.status_code = status.HTTP_202_ACCEPTED
 
-    db.add(address_model)
-    db.flush()
+        return {"message": f"address update queued for {user.get('user_id')}"}
 
-    user_model = db.query(models.Users).filter(models.Users.user_id == user.get("user_id")).first()
-
-    user_model.address_id = address_model.id
+    if save_address(db, user.get("user_id"), address.dict()) is None:
+        raise get_user_exception()
 
-    db.add(user_model)
     db.commit()
+    user_cache.invalidate(user.get("user_id"))
 
-    return {"message": f"address updated for {user.get('user_id')}"}    
-
-
-
-    
\ No newline at end of file
+    return {"message": f"address updated for {user.get('user_id')}"}
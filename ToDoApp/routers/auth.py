@@ -1,27 +1,31 @@
-import sys
-sys.path.append("..")
-
-
 from fastapi import Depends, HTTPException, status, APIRouter, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from starlette.responses import RedirectResponse
 from datetime import datetime, timedelta
-from jose import jwt, JWTError
+from functools import lru_cache
 from pydantic import BaseModel
 from typing import Union
-from passlib.context import CryptContext
+import secrets
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
-import models
+from ..database import SessionLocal
+from ..templating import get_templates, render_cache
+from ..rate_limit import check_username_limit
+from ..cache import TTLCache, user_cache, versions
+from ..write_behind import write_behind
+from .. import config
+from .. import models
 
 #The secret key for encoding the jwt token request
 SECRET_KEY = "TedSecretKey123"
 #The algorithm used for encoding the jwt
 ALGORITHM = "HS256"
 
-templates = Jinja2Templates(directory="templates")
+#Lifetime of the access and refresh tokens. Renewing an access token with a refresh token costs an HMAC check
+#and a primary key lookup instead of a password login with bcrypt.
+ACCESS_TOKEN_EXPIRE = timedelta(minutes=60)
+REFRESH_TOKEN_EXPIRE = timedelta(days=config.REFRESH_TOKEN_DAYS)
 
 #The post-request body for creating a user.
 class CreateUser(BaseModel):
@@ -45,11 +49,19 @@ class LoginForm:
         self.password = form.get("password")
 
 
-#The hashfunction to be used for encrypting passwords
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def get_crypt_context():
+    """
+    Returns the hashfunction to be used for encrypting passwords. passlib is imported and set up on the first password
+    hashed or verified, not when the worker starts.
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-#Creates the database if it does not exist
-models.Base.metadata.create_all(bind=engine)
+#Usernames that were not found, so repeated attempts for them skip the database.
+#Every entry is stamped with the ("usernames",) version, which is bumped when a user is created, so new users can log in right away.
+unknown_usernames = TTLCache(max_size=config.UNKNOWN_USERNAME_CACHE_SIZE, ttl=config.CACHE_TTL_SECONDS)
 
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -79,7 +91,7 @@ def hash_password(password: str) -> str:
 
     Returns
     Hashed password"""
-    return bcrypt_context.hash(password)
+    return get_crypt_context().hash(password)
 
 def verify_password(plain_password, hashed_password) -> bool:
     """
@@ -95,7 +107,15 @@ def verify_password(plain_password, hashed_password) -> bool:
     Returns
     Boolean - False or True depending on if the passwords matches decrypted.
     """
-    return bcrypt_context.verify(plain_password, hashed_password)
+    return get_crypt_context().verify(plain_password, hashed_password)
+
+@lru_cache(maxsize=None)
+def dummy_password_hash() -> str:
+    """
+    Returns a bcrypt hash of a random password. Passwords for unknown usernames are verified against it,
+    so a failed login takes as long whether the username exists or not.
+    """
+    return hash_password(secrets.token_urlsafe(16))
 
 def authenticate_user(username: str, password: str, db) -> dict:
     """
@@ -111,17 +131,59 @@ def authenticate_user(username: str, password: str, db) -> dict:
     Returns
     """
 
-    #queries the table users for the provided username 
-    user = db.query(models.Users).filter(models.Users.username == username).first()
+    #Read before the query, so a user created while querying invalidates the negative entry stored below.
+    usernames_version = versions.get(("usernames",))
+
+    #Known unknown username - no query, but the same bcrypt cost as a real user to not leak that it does not exist.
+    if unknown_usernames.get(username) == usernames_version:
+        verify_password(plain_password=password, hashed_password=dummy_password_hash())
+        return False
+
+    #queries the table users for the provided username. Only the columns needed for the login are loaded.
+    user = (
+        db.query(models.Users.user_id, models.Users.username, models.Users.hashed_password, models.Users.is_active)
+        .filter(models.Users.username == username)
+        .first()
+    )
+
+    #Ends the read before the slow bcrypt verify. With sqlite the session's transaction holds the write lock (BEGIN
+    #IMMEDIATE), which would make every write of every worker wait for the login. The refresh token is written in a new one.
+    db.rollback()
+
+    if user is None:
+        unknown_usernames.set(username, usernames_version)
+        verify_password(plain_password=password, hashed_password=dummy_password_hash())
+        return False
 
-    #if username exists and the password is correct (validated towards the hashed password) the it returns the user in json
-    if user and verify_password(plain_password=password, hashed_password=user.hashed_password):
+    #if the password is correct (validated towards the hashed password) and the user is active then it returns the user
+    if verify_password(plain_password=password, hashed_password=user.hashed_password) and user.is_active:
         return user
     
     else:
         return False
 
 
+def encode_token(claims: dict) -> str:
+    """Encodes the claims into a jwt signed with the SECRET_KEY. jose is imported on the first token, not at startup."""
+    from jose import jwt
+
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_token(token: str) -> Union[dict, None]:
+    """
+    Decodes the jwt using the SECRET KEY and the given algorithm.
+
+    ------
+    Returns
+    dict of the claims, None if the token is invalid or expired
+    """
+    from jose import jwt, JWTError
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
 def create_access_token(username: str, user_id: int, expires_delta: Union[timedelta, None] = None):
     """
     Creates jwt-token based on the encode dictionary with username and user_id.
@@ -138,8 +200,9 @@ def create_access_token(username: str, user_id: int, expires_delta: Union[timede
     jwt-token encoded with SH256 algorithm.
     """
     
-    #Create the claims for the jwt-encoding. Will include "sub" key for username and "id" key for user_id 
-    encode = {"sub": username, "id": user_id}
+    #Create the claims for the jwt-encoding. Will include "sub" key for username and "id" key for user_id.
+    #The "type" tells it apart from a refresh token, which must never be accepted as an access token.
+    encode = {"sub": username, "id": user_id, "type": "access"}
 
     #If expires_delta param is set then it will take current time (in utc) + timedelta in mins.
     if expires_delta:
@@ -151,7 +214,66 @@ def create_access_token(username: str, user_id: int, expires_delta: Union[timede
     #includes in the claims when the token will expire.
     encode.update({"exp": expire})
 
-    return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encode_token(encode)
+
+def create_refresh_token(username: str, user_id: int, db, family_id: Union[str, None] = None) -> str:
+    """
+    Creates a refresh token and adds its record to the session. The caller commits.
+
+    ------
+    Parameters
+    username: str of the username to create the token for
+    user_id: int of the user_id to create the token for
+    db: the database session
+    family_id: str of the family of the rotated token. None starts a new family (a new login).
+
+    ------
+    Returns
+    jwt-token encoded with HS256, holding the id (jti) of the stored record.
+    """
+    token_id = secrets.token_hex(16)
+    expire = datetime.utcnow() + REFRESH_TOKEN_EXPIRE
+
+    refresh_token_model = models.RefreshTokens()
+
+    refresh_token_model.token_id = token_id
+    refresh_token_model.user_id = user_id
+    refresh_token_model.family_id = family_id or token_id
+    refresh_token_model.expires_at = expire
+    refresh_token_model.revoked = False
+
+    db.add(refresh_token_model)
+
+    encode = {"sub": username, "id": user_id, "jti": token_id, "type": "refresh", "exp": expire}
+
+    return encode_token(encode)
+
+def set_token_cookies(response: Response, access_token: str, refresh_token: str) -> None:
+    response.set_cookie(key="access_token", value=access_token, httponly=True)
+    #The refresh cookie is only sent to the auth endpoints.
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        path="/auth",
+        max_age=int(REFRESH_TOKEN_EXPIRE.total_seconds())
+    )
+
+def revoke_refresh_tokens(db, user_id: int) -> None:
+    """
+    Revokes every refresh token of the user (uses the user_id index). The caller commits.
+
+    ------
+    Parameters
+    db: the database session
+    user_id: int of the user
+    """
+    (
+        db.query(models.RefreshTokens)
+        .filter(models.RefreshTokens.user_id == user_id)
+        .filter(models.RefreshTokens.revoked == False)
+        .update({"revoked": True}, synchronize_session=False)
+    )
 
 async def get_current_user(token: str = Depends(oauth2_bearer)):
     """
@@ -163,47 +285,117 @@ async def get_current_user(token: str = Depends(oauth2_bearer)):
     token: str of the decoded token"""
 
     #Decodes the encoded jwt in claims given the secret key and algorithm.
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        #Gets the username and user_id from the claims dictionary
-        username: str = payload.get("sub")
-        user_id: int = payload.get("id")
-
-        #If username or user_id is not in the claims (from the jwt) then an user exception is thrown.
-        if username is None or user_id is None:
-            raise get_user_exception()
-        
-        return {"username": username, "user_id": user_id}
-    
-    #If JWT is incorrect then user exception is thrown.
-    except JWTError:
+    payload = decode_token(token)
+
+    #If JWT is incorrect, or is not an access token (e.g. a refresh token), then user exception is thrown.
+    if payload is None or payload.get("type") != "access":
         raise get_user_exception()
 
-#Creates user in users table
-@router.post("/user/create")
-async def create_new_user(create_user: CreateUser, db: Session = Depends(get_db)):
+    #Gets the username and user_id from the claims dictionary
+    username: str = payload.get("sub")
+    user_id: int = payload.get("id")
+
+    #If username or user_id is not in the claims (from the jwt) then an user exception is thrown.
+    if username is None or user_id is None:
+        raise get_user_exception()
+
+    return {"username": username, "user_id": user_id}
+
+#The user columns that may be returned or cached - every column but the password hash and the deletion bookkeeping.
+USER_COLUMNS = tuple(column for column in models.Users.__table__.columns if column.key not in ("hashed_password", "deleted_at"))
+
+def load_user(request: Request, db, user_id: int) -> Union[dict, None]:
+    """
+    Returns the user without the password hash. Looked up in the request's identity map, then in the user cache,
+    and only then in the database, so a user is fetched at most once per request.
+
+    ------
+    Parameters
+    request: the current request, which holds the identity map
+    db: the database session
+    user_id: int of the user
+
+    ------
+    Returns
+    dict of the user, None if the user does not exist
+    """
+    identity_map = getattr(request.state, "users", None)
+
+    if identity_map is None:
+        identity_map = request.state.users = {}
+
+    if user_id not in identity_map:
+        def load() -> Union[dict, None]:
+            #Users being deleted are no longer returned.
+            row = db.execute(select(*USER_COLUMNS).where(models.Users.user_id == user_id).where(models.Users.deleted_at.is_(None))).first()
+            return dict(row._mapping) if row else None
+
+        identity_map[user_id] = user_cache.get_or_load(user_id, load)
+
+    return identity_map[user_id]
+
+def save_user(db, user: dict) -> None:
+    """
+    Adds the user to the session. The caller commits.
+
+    ------
+    Parameters
+    db: the database session
+    user: dict of the CreateUser body, with hashed_password instead of password
+    """
 
     #model so we can assign values from the post request body to the db columns.
     create_user_model = models.Users()
 
-    create_user_model.username = create_user.username
-    create_user_model.email = create_user.email
-    create_user_model.first_name = create_user.first_name
-    create_user_model.last_name = create_user.last_name
-    create_user_model.hashed_password = hash_password(create_user.password)
+    create_user_model.username = user["username"]
+    create_user_model.email = user["email"]
+    create_user_model.first_name = user["first_name"]
+    create_user_model.last_name = user["last_name"]
+    create_user_model.hashed_password = user["hashed_password"]
     create_user_model.is_active = True
-    create_user_model.phone_number = create_user.phone_num
+    create_user_model.phone_number = user["phone_num"]
 
     #Adds the user model to the commit queue
     db.add(create_user_model)
 
+
+#In write-behind mode users are created in batches. The username may be in the cache of unknown usernames (in any worker).
+write_behind.register(
+    "create_user",
+    save_user,
+    key=lambda payload: payload["username"],
+    after_commit=lambda payload: versions.incr(("usernames",))
+)
+
+#Creates user in users table
+@router.post("/user/create")
+async def create_new_user(create_user: CreateUser, response: Response, db: Session = Depends(get_db)):
+
+    #The password is hashed in the request, so the queued write never contains the plain text password.
+    user = create_user.dict(exclude={"password"})
+    user["hashed_password"] = hash_password(create_user.password)
+
+    #Queued and committed in a batch by the background task.
+    if write_behind.running:
+        write_behind.enqueue("create_user", user)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return
+
+    save_user(db, user)
+
     #Commits the things in the queue.
     db.commit()
 
+    #The username may be in the cache of unknown usernames (in any worker).
+    versions.incr(("usernames",))
+
 
 @router.post("/token/")
 async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
 
+    #Rejects the attempt if the username is out of login attempts, before any database query or bcrypt verify.
+    check_username_limit(form_data.username)
+
     #Authenticates the user by checking form data from the api towards the username and password in the database.
     user = authenticate_user(form_data.username, form_data.password, db)
 
@@ -211,19 +403,83 @@ async def login_for_access_token(response: Response, form_data: OAuth2PasswordRe
     if not user:
         raise False
 
-    #Sets the token expiry in 20mins
-    token_expires = timedelta(minutes=60)
-
-    #Creates an jwt token
-    token = create_access_token(username=user.username, user_id=user.user_id, expires_delta=token_expires)
+    #Creates an jwt token, and a refresh token so the session can be renewed without logging in again.
+    token = create_access_token(username=user.username, user_id=user.user_id, expires_delta=ACCESS_TOKEN_EXPIRE)
+    refresh_token = create_refresh_token(username=user.username, user_id=user.user_id, db=db)
+    db.commit()
 
-    response.set_cookie(key="access_token", value=token, httponly=True)
+    set_token_cookies(response, token, refresh_token)
 
     return True
 
+#Renews the access token from the refresh cookie. The refresh token is rotated: the used one is revoked and a new one is issued.
+@router.post("/refresh")
+async def refresh_access_token(request: Request, response: Response, db: Session = Depends(get_db)):
+
+    payload = decode_token(request.cookies.get("refresh_token", ""))
+
+    if payload is None or payload.get("type") != "refresh":
+        raise get_user_exception()
+
+    stored_token = db.query(models.RefreshTokens).filter(models.RefreshTokens.token_id == payload.get("jti")).first()
+
+    if stored_token is None:
+        raise get_user_exception()
+
+    #Revokes the token only if it still is valid. The update locks the row, so of two concurrent refreshes with the same
+    #token only one revokes it, and the other one sees it revoked.
+    rotated = (
+        db.query(models.RefreshTokens)
+        .filter(models.RefreshTokens.token_id == stored_token.token_id)
+        .filter(models.RefreshTokens.revoked == False)
+        .update({"revoked": True}, synchronize_session=False)
+    )
+
+    #A revoked token being used again means it was stolen (or replayed), so the whole family is revoked.
+    if not rotated:
+        (
+            db.query(models.RefreshTokens)
+            .filter(models.RefreshTokens.family_id == stored_token.family_id)
+            .update({"revoked": True}, synchronize_session=False)
+        )
+        db.commit()
+        raise get_user_exception()
+
+    token = create_access_token(username=payload.get("sub"), user_id=stored_token.user_id, expires_delta=ACCESS_TOKEN_EXPIRE)
+    refresh_token = create_refresh_token(
+        username=payload.get("sub"), user_id=stored_token.user_id, db=db, family_id=stored_token.family_id
+    )
+    db.commit()
+
+    set_token_cookies(response, token, refresh_token)
+
+    return {"message": "token refreshed"}
+
+#Logs out by revoking the refresh token family and removing the cookies.
+@router.post("/logout")
+async def logout(request: Request, response: Response, db: Session = Depends(get_db)):
+
+    payload = decode_token(request.cookies.get("refresh_token", ""))
+
+    if payload is not None:
+        stored_token = db.query(models.RefreshTokens).filter(models.RefreshTokens.token_id == payload.get("jti")).first()
+
+        if stored_token is not None:
+            (
+                db.query(models.RefreshTokens)
+                .filter(models.RefreshTokens.family_id == stored_token.family_id)
+                .update({"revoked": True}, synchronize_session=False)
+            )
+            db.commit()
+
+    response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token", path="/auth")
+
+    return {"message": "logged out"}
+
 @router.get("/", response_class=HTMLResponse)
 async def authentication_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return render_cache.page(request, "login.html")
 
 
 @router.post("/", response_class=HTMLResponse)
@@ -239,18 +495,22 @@ async def login(request: Request, db: Session = Depends(get_db)):
 
         if not validate_user_cookie:
             msg = "Incorrect Username or Password"
-            return templates.TemplateResponse("login.html", {"request": request, "msg": msg})
+            return get_templates().TemplateResponse("login.html", {"request": request, "msg": msg})
         
         return response
     
-    except HTTPException:
+    except HTTPException as exception:
+        if exception.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            msg = "Too many login attempts, try again later"
+            return get_templates().TemplateResponse("login.html", {"request": request, "msg": msg}, status_code=exception.status_code, headers=exception.headers)
+
         msg = "Unknow Error"
-        return templates.TemplateResponse("login.html", {"request": request, "msg":msg})
+        return get_templates().TemplateResponse("login.html", {"request": request, "msg":msg})
         
 
 @router.get("/register", response_class=HTMLResponse)
 async def register(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request})
+    return render_cache.page(request, "register.html")
 
 #Exceptions
 def get_user_exception():
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends
+from ..write_behind import write_behind
+from ..scheduler import scheduler
+from ..database import replicas
+from single_flight import flights
+from ..admission import admission_limiter
+from .auth import get_current_user
+
+#Setting up the router for the operational metrics of the application. They describe the internals (replicas, queues,
+#jobs), so every endpoint requires a logged in user.
+router = APIRouter(
+    prefix="/ops",
+    tags=["ops"],
+    dependencies=[Depends(get_current_user)]
+)
+
+#Returns the write-behind queue metrics: pending writes, lag of the oldest pending write and flush counters.
+@router.get("/write-behind")
+async def write_behind_metrics():
+    return write_behind.metrics()
+
+#Returns the stats of the maintenance jobs: runs, batches, processed rows, duration and errors.
+@router.get("/jobs")
+async def maintenance_jobs():
+    return scheduler.stats()
+
+#Returns the health of the read replicas: lag behind the primary, last check and error.
+@router.get("/replicas")
+async def replica_status():
+    return replicas.status
+
+#Returns the single-flight stats per route: executions, collapsed requests, waits that timed out and requests in flight.
+@router.get("/single-flight")
+async def single_flight_stats():
+    return flights.stats()
+
+#Returns the admission control state: current limit, requests in flight and queued, and the counters per priority class.
+@router.get("/admission")
+async def admission_stats():
+    return admission_limiter.stats()
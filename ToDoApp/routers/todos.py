@@ -1,17 +1,19 @@
-import sys
-sys.path.append("..")
-
 from fastapi import Depends, HTTPException, status, APIRouter, Request, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, StreamingResponse
 from starlette import status
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, Response
 from typing import Union
-from database import engine, SessionLocal
+from datetime import datetime
+from ..database import SessionLocal, get_read_db, reads_primary
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
-from routers.auth import get_current_user, get_user_exception
-import models
+from .auth import get_current_user, get_user_exception
+from ..templating import get_templates, render_cache
+from ..cache import todo_cache, todo_as_dict
+from .. import todo_summary
+from single_flight import single_flight
+from ..events import broker, format_event, owner_channel, publish_todo, publish_todo_removed
+from .. import models
 
 router = APIRouter(
     prefix="/todos",
@@ -19,11 +21,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-models.Base.metadata.create_all(bind=engine)
-
-#For directing the api to the html templates. This is the dir.
-templates = Jinja2Templates(directory="templates")
-
 
 #Exception handlers (DRY)
 def http_exception_404(item_id: Union[str, int] = None):
@@ -54,20 +51,118 @@ def get_db():
         db.close()
 
 
-@router.get("/", response_class=HTMLResponse)
-async def read_all_by_user(request: Request, db: Session = Depends(get_db)):
+def restore_archived_todo(db: Session, todo_id: int) -> Union[models.ToDos, None]:
+    """
+    Moves an archived todo back to the todos table (e.g. when it is un-completed or edited from the history). The caller commits.
 
-    user_todos = db.query(models.ToDos).filter(models.ToDos.owner_id == 1).all()
+    ------
+    Parameters
+    db: the database session
+    todo_id: int of the todo id
+
+    ------
+    Returns
+    The restored ToDos model, None if the todo is not archived either
+    """
+    archived = db.query(models.TodosArchive).filter(models.TodosArchive.todo_id == todo_id).first()
+
+    if archived is None:
+        return None
+
+    todo_model = models.ToDos()
+
+    todo_model.todo_id = archived.todo_id
+    todo_model.title = archived.title
+    todo_model.description = archived.description
+    todo_model.priority = archived.priority
+    todo_model.complete = archived.complete
+    todo_model.completed_at = archived.completed_at
+    todo_model.owner_id = archived.owner_id
+
+    db.delete(archived)
+    db.add(todo_model)
+    db.flush()
+
+    return todo_model
+
+
+#Seconds between the keep-alive comments of the event stream, so proxies do not close an idle connection.
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+def action_response(request: Request) -> Response:
+    """
+    Response of the todo actions. The live home page calls them with fetch and patches the row from the event stream,
+    so it gets an empty response; plain links and forms are redirected back to the list.
+    """
+    if request.headers.get("X-Requested-With") == "fetch":
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+
+
+#Concurrent requests for the list are answered by one render. Keyed by the host the page is rendered for (its links),
+#as every request reads the todos of owner 1, and by whether it reads from the primary (after a write) or a replica.
+@router.get("/", response_class=HTMLResponse)
+@single_flight(
+    "read_all_by_user",
+    key=lambda arguments: (str(arguments["request"].base_url), arguments["history"], reads_primary(arguments["db"]))
+)
+async def read_all_by_user(request: Request, history: bool = False, db: Session = Depends(get_read_db)):
 
     "Sends api request and returns the home with the layout given in home.html."
 
+    #The archived (cold) todos are only queried when the history is asked for. That page is rare, so it is not cached.
+    if history:
+        todos = db.query(models.ToDos).filter(models.ToDos.owner_id == 1).all()
+        archived_todos = db.query(models.TodosArchive).filter(models.TodosArchive.owner_id == 1).all()
+        todos = sorted(todos + archived_todos, key=lambda todo: todo.todo_id)
+
+        return get_templates().TemplateResponse("home.html", {"request": request, "todos": todos, "history": True})
+
+    #The page is only rendered if it is not cached for the current version of the owner's todo list,
+    #and the todos are only queried if the list itself is not cached either.
+    def load_todos() -> list:
+        return [todo_as_dict(todo) for todo in db.query(models.ToDos).filter(models.ToDos.owner_id == 1).all()]
+
+    return render_cache.page(
+        request,
+        "home.html",
+        scope=("owner", 1),
+        context_factory=lambda: {"todos": todo_cache.get_or_load(1, load_todos)}
+    )
+
+
+#Server-sent events of the changes to the owner's todos: {"type": "upsert", "todo": {...}}, {"type": "remove", "todo_id": ...}
+#or {"type": "reload"} if the page missed events.
+@router.get("/events")
+async def todo_events(request: Request):
+
+    async def stream():
+        async with broker.subscribe(owner_channel(1)) as subscription:
+            #Tells the browser how long to wait before reconnecting.
+            yield "retry: 3000\n\n"
+
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                yield format_event(event) if event else ": keep-alive\n\n"
 
-    return templates.TemplateResponse("home.html", {"request": request, "todos": user_todos})
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+#Returns the counters of the owner's todos: open, completed and open by priority. One primary key lookup, no counting.
+@router.get("/summary")
+async def todo_summary_counts(db: Session = Depends(get_read_db)):
+    return todo_summary.summary_as_dict(db.get(models.TodoSummary, 1))
 
 
 @router.get("/add-todo", response_class=HTMLResponse)
 async def add_new_todo(request: Request):
-    return templates.TemplateResponse("add-todo.html", {"request": request})
+    return render_cache.page(request, "add-todo.html")
 
 @router.post("/add-todo", response_class=HTMLResponse)
 async def create_todo(
@@ -86,17 +181,33 @@ async def create_todo(
     todo_model.owner_id = 1
 
     db.add(todo_model)
+    #Flushing assigns the todo_id, so the cached copy can be built without reloading the row after the commit.
+    db.flush()
+    todo = todo_as_dict(todo_model)
+    #The owner's counters are updated in the same transaction as the todo.
+    todo_summary.record_change(db, 1, None, todo)
     db.commit()
 
+    #Bumps the ("owner", 1) version as well, which invalidates the rendered home page.
+    todo_cache.put(1, todo)
+    render_cache.invalidate(("todo", todo["todo_id"]))
+    publish_todo(todo)
+
     #The return call redirects and calls a get request after the api-post method has been called
-    return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+    return action_response(request)
 
 @router.get("/edit-todo/{todo_id}", response_class=HTMLResponse)
-async def edit_todo(request: Request, todo_id: int, db: Session = Depends(get_db)):
-
-    todo = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first()
-
-    return templates.TemplateResponse("edit-todo.html", {"request":request, "todo": todo})
+async def edit_todo(request: Request, todo_id: int, db: Session = Depends(get_read_db)):
+
+    return render_cache.page(
+        request,
+        "edit-todo.html",
+        scope=("todo", todo_id),
+        context_factory=lambda: {
+            "todo": db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first()
+            or db.query(models.TodosArchive).filter(models.TodosArchive.todo_id == todo_id).first()
+        }
+    )
 
 @router.post("/edit-todo/{todo_id}", response_class=HTMLResponse)
 async def edit_todo_commit(
@@ -107,16 +218,24 @@ async def edit_todo_commit(
     priority: int = Form(...),
     db: Session = Depends(get_db)):
 
-    todo_model = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first()
+    #An archived todo is moved back to the hot table when it is edited.
+    todo_model = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first() or restore_archived_todo(db, todo_id)
+    before = todo_as_dict(todo_model)
 
     todo_model.title = title
     todo_model.description = description
     todo_model.priority = priority
+    todo = todo_as_dict(todo_model)
 
     db.add(todo_model)
+    todo_summary.record_change(db, todo["owner_id"], before, todo)
     db.commit()
 
-    return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+    todo_cache.put(todo["owner_id"], todo)
+    render_cache.invalidate(("todo", todo_id))
+    publish_todo(todo)
+
+    return action_response(request)
 
 #Since it is a fullstack application it will use http method get instead of post since we are calling the application
 #And the delete function is handled within the edit-todo.html instead.
@@ -125,28 +244,56 @@ async def delete_todo(request: Request, todo_id: int, db: Session = Depends(get_
 
     todo_model = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).filter(models.ToDos.owner_id == 1).first()
 
+    #The todo may be archived, then it is deleted from the archive and the hot list is unchanged.
     if todo_model is None:
-        return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+        archived = (
+            db.query(models.TodosArchive)
+            .filter(models.TodosArchive.todo_id == todo_id)
+            .filter(models.TodosArchive.owner_id == 1)
+            .first()
+        )
+
+        if archived is not None:
+            db.delete(archived)
+            todo_summary.record_change(db, 1, todo_as_dict(archived), None)
+            db.commit()
+            render_cache.invalidate(("todo", todo_id))
+
+        return action_response(request)
     
     db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).delete()
+    todo_summary.record_change(db, 1, todo_as_dict(todo_model), None)
 
     db.commit()
 
-    return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+    todo_cache.remove(1, todo_id)
+    render_cache.invalidate(("todo", todo_id))
+    publish_todo_removed(1, todo_id)
+
+    return action_response(request)
 
 
 @router.get("/complete/{todo_id}", response_class=HTMLResponse)
 async def complete_todo(request: Request, todo_id: int, db: Session = Depends(get_db)):
 
-    todo = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first()
+    #An archived todo is moved back to the hot table when it is un-completed.
+    todo = db.query(models.ToDos).filter(models.ToDos.todo_id == todo_id).first() or restore_archived_todo(db, todo_id)
+    before = todo_as_dict(todo)
 
     #Will switch the complete bool (if currently False -> True and vice versa)
     todo.complete = not todo.complete 
+    todo.completed_at = datetime.utcnow() if todo.complete else None
+    cached_todo = todo_as_dict(todo)
 
     db.add(todo)
+    todo_summary.record_change(db, cached_todo["owner_id"], before, cached_todo)
     db.commit()
 
-    return RedirectResponse(url="/todos", status_code=status.HTTP_302_FOUND)
+    todo_cache.put(cached_todo["owner_id"], cached_todo)
+    render_cache.invalidate(("todo", todo_id))
+    publish_todo(cached_todo)
+
+    return action_response(request)
 
 
     
\ No newline at end of file
@@ -1,21 +1,20 @@
-import sys
-sys.path.append("..")
-
-from fastapi import APIRouter, Depends, HTTPException, status
-from database import engine, SessionLocal
-from routers.auth import get_current_user, hash_password, get_user_exception
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from ..database import SessionLocal, get_read_db, reads_primary
+from .auth import USER_COLUMNS, get_current_user, hash_password, get_user_exception, load_user, revoke_refresh_tokens
+from ..cache import user_cache
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-import models
+from fast_responses import FastJSONResponse
+from single_flight import single_flight
+from .. import account_deletion
+from .. import models
 
 #class that will be the body of the post-request when user wants to update password.
 class UpdatePassword(BaseModel):
     new_password: str
 
 
-#Creates the database if it does not exist
-models.Base.metadata.create_all(bind=engine)
-
 #Setting up the router for this API.
 router = APIRouter(
     prefix="/users",
@@ -36,44 +35,27 @@ def get_db():
 
 #Returning all the users in the database as json.
 @router.get("/")
-async def get_all_users(db: Session = Depends(get_db)):
+async def get_all_users(db: Session = Depends(get_read_db)):
 
-    #Queries the table users and retrieves all. Like SELECT * from users;
-    users = db.query(models.Users).all()
+    #Queries the public columns of the users, without the password hash. Users being deleted are no longer returned.
+    users = db.execute(select(*USER_COLUMNS).where(models.Users.deleted_at.is_(None))).all()
 
     #If query does not return anything (db is empty and not initialized) then exception will be raised.
     if not users:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No users found")
 
-    return users
+    #The rows are serialized straight to bytes, skipping FastAPI's jsonable_encoder.
+    return FastJSONResponse([dict(user._mapping) for user in users])
 
-#Returns the user based on user id given in the path.
+#Returns the user based on user id given in the path, or in the query parameters /user/?user_id=<user_id>
+#Served from the user cache, without the password hash. Concurrent requests for the same user are answered by one lookup,
+#unless one reads from the primary (after a write) and the other from a replica.
 @router.get("/user/{user_id}")
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-
-    #Queries the table users given the user id. Like SELECT * FROM users WHERE user_id = <user_id>
-    user = (
-    db.query(models.Users)
-    .filter(models.Users.user_id == user_id)
-    .first()
-    )
-
-    #If user with user_id is not found in table then it will raise an 404 exception.
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No users found")
-
-    return user
-
-#Returns the users based on query parameters /user/?user_id=<user_id>
 @router.get("/user/")
-async def query_user(user_id: int, db: Session = Depends(get_db)):
-    
-    #Queries the table users given the user id. Like SELECT * FROM users WHERE user_id = <user_id>
-    user = (
-    db.query(models.Users)
-    .filter(models.Users.user_id == user_id)
-    .first()
-    )
+@single_flight("get_user", key=lambda arguments: (arguments["user_id"], reads_primary(arguments["db"])))
+async def get_user(request: Request, user_id: int, db: Session = Depends(get_read_db)):
+
+    user = load_user(request, db, user_id)
 
     #If user with user_id is not found in table then it will raise an 404 exception.
     if not user:
@@ -89,22 +71,21 @@ async def change_user_password(update_password: UpdatePassword, user: dict = Dep
     if user is None:
         raise get_user_exception()
 
-    #Queries the users table and returns the given, authenticated, user.
-    current_user = (
-        db.query(models.Users)
-        .filter(models.Users.user_id == user.get("user_id"))
-        .first()
-    )
+    #Hashed before the update, so the transaction (the sqlite write lock) is not held during bcrypt.
+    hashed_password = hash_password(update_password.new_password)
 
-    #If query found the user it updates the user's password and encrypts it, given the provided password in the post body.
-    if current_user:
-        current_user.hashed_password = hash_password(update_password.new_password)
-    
-        #Adds the current user model in the db commit queue.
-        db.add(current_user)
+    #Updates the user's password (encrypted) in place, without loading the user first.
+    updated = db.execute(
+        update(models.Users)
+        .where(models.Users.user_id == user.get("user_id"))
+        .values(hashed_password=hashed_password)
+    ).rowcount
 
-        #Commits the model within the queue.
+    #If the user was found and updated, the sessions renewed with the old password are logged out and the change is commited.
+    if updated:
+        revoke_refresh_tokens(db, user.get("user_id"))
         db.commit()
+        user_cache.invalidate(user.get("user_id"))
 
         return {"message": f"password updated for {user.get('username')}"}
 
@@ -112,28 +93,32 @@ async def change_user_password(update_password: UpdatePassword, user: dict = Dep
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not change password")
 
-#Deletes the given authenticated user.
+#Deletes the given authenticated user with its todos, tokens and address.
+#Large accounts are deactivated right away and deleted in chunks in the background (202 Accepted).
 @router.delete("/user")
-async def delete_user(user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_user(response: Response, user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
 
     #If the user is not authenticated via JWT then the user exception is thrown.
     if user is None:
-        get_user_exception()
-    
-    #QUeries the table users for the given user_id (from decoded jwt-token)
-    current_user = (
-        db.query(models.Users)
-        .filter(models.Users.user_id == user.get("user_id"))
-        .delete()
-    )
+        raise get_user_exception()
+
+    user_id = user.get("user_id")
+
+    if account_deletion.is_large_account(db, user_id):
+        deleted = account_deletion.schedule_deletion(db, user_id)
+        response.status_code = status.HTTP_202_ACCEPTED
+    else:
+        deleted = account_deletion.delete_user_now(db, user_id)
 
     #If user could not be found in db, then an exception is thrown.
-    if not current_user:
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
     
     #Commits the deletion.
     db.commit()
+    account_deletion.after_deletion(user_id)
 
-    return {"message": f"user {user.get('username')} was deleted."}
-
+    if response.status_code == status.HTTP_202_ACCEPTED:
+        return {"message": f"user {user.get('username')} is being deleted."}
 
+    return {"message": f"user {user.get('username')} was deleted."}
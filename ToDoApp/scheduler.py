@@ -0,0 +1,147 @@
+"""
+Module for the in-process scheduler running the periodic maintenance jobs.
+
+A job is a function(db, batch_size) -> int that processes at most batch_size rows in its own transaction and returns
+how many it processed. On every run the scheduler calls it again and again until it processes less than a full batch
+or the time budget of the run is spent, so no single transaction holds locks for long.
+Jobs run in a thread so the event loop keeps serving requests.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Union
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hours(hours: str) -> Union[set, None]:
+    """
+    Parses an hour window like "1-5" or "22-3" (UTC, both inclusive, may wrap midnight).
+
+    ------
+    Returns
+    set of the allowed hours, None (any hour) for an empty string
+    """
+    if not hours:
+        return None
+
+    start, end = (int(hour) for hour in hours.split("-"))
+
+    if start <= end:
+        return set(range(start, end + 1))
+
+    return set(range(start, 24)) | set(range(0, end + 1))
+
+
+class Job:
+    def __init__(self,
+                 name: str,
+                 func: Callable,
+                 interval: float,
+                 batch_size: int = 1000,
+                 time_budget: float = 5.0,
+                 pause: float = 0.05,
+                 hours: Union[set, None] = None) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.pause = pause
+        self.hours = hours
+        self.stats = {"runs": 0, "batches": 0, "processed": 0, "errors": 0, "last_run_at": None, "last_run_seconds": None, "last_error": None}
+
+    def _run_batch(self) -> int:
+        db = SessionLocal()
+        try:
+            return self.func(db, self.batch_size)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def run_once(self) -> int:
+        """
+        Runs the job batch by batch until it is done or the time budget is spent.
+
+        ------
+        Returns
+        int of the number of processed rows
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        processed = 0
+
+        while True:
+            batch = await loop.run_in_executor(None, self._run_batch)
+            processed += batch
+            self.stats["batches"] += 1
+
+            if batch < self.batch_size or time.monotonic() - started > self.time_budget:
+                break
+
+            #Gives other transactions room between the batches.
+            await asyncio.sleep(self.pause)
+
+        self.stats["runs"] += 1
+        self.stats["processed"] += processed
+        self.stats["last_run_at"] = time.time()
+        self.stats["last_run_seconds"] = round(time.monotonic() - started, 3)
+
+        return processed
+
+    async def loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if self.hours is not None and datetime.utcnow().hour not in self.hours:
+                continue
+
+            try:
+                processed = await self.run_once()
+                if processed:
+                    logger.info("Maintenance job %s processed %d rows", self.name, processed)
+            except Exception as exception:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = repr(exception)
+                logger.exception("Maintenance job %s failed", self.name)
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self.jobs: dict = {}
+        self._tasks: list = []
+
+    def add(self, name: str, func: Callable, interval: float, **options) -> Job:
+        """
+        Adds a job. See Job for the options (batch_size, time_budget, pause, hours).
+
+        ------
+        Parameters
+        name: str of the job name
+        func: callable(db, batch_size) -> int of processed rows
+        interval: float of the seconds between runs
+        """
+        job = Job(name, func, interval, **options)
+        self.jobs[name] = job
+
+        return job
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(job.loop()) for job in self.jobs.values()]
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {name: {**job.stats, "interval": job.interval, "batch_size": job.batch_size} for name, job in self.jobs.items()}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,227 @@
+"""
+Seeds the database with generated users, addresses and todos, so benchmarks and query plans run against real data volumes.
+
+The data is deterministic: the same seed on an empty database gives the same rows (dates relative to the time of seeding).
+Users get ids after the current highest one, so seeding can be repeated to grow the data. Everything is generated and
+inserted in batches of users, so memory stays flat for millions of rows:
+- Postgres: COPY (csv), the fastest way to load rows
+- other databases (sqlite): executemany inserts
+Every user has the same password (bcrypt is hashed once), and the todo counters (todo_summary) are written with the
+todos. Completed todos older than ARCHIVE_AFTER_DAYS go to todos_archive, as the archive job would have moved them.
+
+Usage (from the repository root): python -m ToDoApp.seed --users 100000 --todos-per-user 20 --seed 42
+"""
+
+import argparse
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select, text
+from .database import IS_SQLITE, get_engine
+from .routers.auth import hash_password
+from . import config
+from . import models
+from . import todo_summary
+
+FIRST_NAMES = ("Anna", "Erik", "Maria", "Lars", "Sofia", "Johan", "Emma", "Karl", "Ingrid", "Olof", "Elsa", "Nils",
+               "Astrid", "Gustav", "Liam", "Olivia", "Noah", "Ava", "Lucas", "Mia", "Hugo", "Alice", "Oscar", "Maja")
+LAST_NAMES = ("Lindqvist", "Berg", "Nilsson", "Holm", "Ek", "Strand", "Dahl", "Lund", "Wallin", "Forsberg", "Hedlund",
+              "Smith", "Johnson", "Brown", "Garcia", "Miller", "Davis", "Wilson", "Moore", "Taylor", "Clark", "Lewis")
+CITIES = (("Stockholm", "Stockholm", "Sweden", "1"), ("Gothenburg", "Västra Götaland", "Sweden", "4"),
+          ("Malmö", "Skåne", "Sweden", "2"), ("Oslo", "Oslo", "Norway", "0"), ("Berlin", "Berlin", "Germany", "1"),
+          ("Austin", "Texas", "USA", "7"), ("Denver", "Colorado", "USA", "8"), ("Seattle", "Washington", "USA", "9"))
+STREETS = ("Main Street", "Storgatan", "Kungsgatan", "Oak Avenue", "Drottninggatan", "Park Road", "Church Lane", "Mill Road")
+TODO_VERBS = ("Buy", "Call", "Fix", "Clean", "Book", "Pay", "Write", "Plan", "Return", "Cancel", "Renew", "Pick up")
+TODO_OBJECTS = ("groceries", "the dentist", "the bike", "the garage", "flights", "the electricity bill", "a birthday card",
+                "the weekend", "library books", "the gym membership", "the passport", "the car")
+TODO_DETAILS = ("Before friday", "Ask about the discount", "Check the receipt first", "Not urgent", "Do it after work",
+                "Remember the reference number", "Together with Anna", "Online if possible")
+
+#Most todos have a middling priority, like in real lists.
+PRIORITY_WEIGHTS = (10, 25, 35, 20, 10)
+COMPLETED_SHARE = 0.4
+#How far back the todos were completed, the ones older than ARCHIVE_AFTER_DAYS end up in the archive.
+HISTORY_DAYS = 365
+
+#The tables filled, in insert order (a foreign key's table comes first) with their columns.
+SEED_TABLES = (
+    (models.Address, ("id", "address1", "address2", "city", "state", "country", "postalcode", "apt_num")),
+    (models.Users, ("user_id", "email", "username", "first_name", "last_name", "hashed_password", "is_active", "phone_number", "address_id")),
+    (models.ToDos, ("todo_id", "title", "description", "priority", "complete", "completed_at", "owner_id")),
+    (models.TodosArchive, ("todo_id", "title", "description", "priority", "complete", "completed_at", "owner_id", "archived_at")),
+    (models.TodoSummary, ("owner_id",) + todo_summary.COUNTER_COLUMNS)
+)
+
+#The serial primary keys whose Postgres sequence is moved past the seeded ids, with the tables holding those ids
+#(todo ids are shared by todos and todos_archive, as in next_ids).
+SEQUENCES = (("address", "id", ("address",)), ("users", "user_id", ("users",)), ("todos", "todo_id", ("todos", "todos_archive")))
+
+
+def next_ids(connection) -> tuple:
+    """Returns the first free address, user and todo id (todo ids are shared by todos and todos_archive)."""
+    address_id = connection.execute(select(func.max(models.Address.id))).scalar() or 0
+    user_id = connection.execute(select(func.max(models.Users.user_id))).scalar() or 0
+    todo_id = max(
+        connection.execute(select(func.max(models.ToDos.todo_id))).scalar() or 0,
+        connection.execute(select(func.max(models.TodosArchive.todo_id))).scalar() or 0
+    )
+
+    return address_id + 1, user_id + 1, todo_id + 1
+
+
+def generate_batch(rng: random.Random, users: int, todos_per_user: int, hashed_password: str, ids: dict, now: datetime) -> dict:
+    """
+    Generates the rows of a batch of users.
+
+    ------
+    Parameters
+    rng: random.Random generating the data
+    users: int of the number of users in the batch
+    todos_per_user: int of the average number of todos per user
+    hashed_password: str of the password hash shared by every user
+    ids: dict of the next "address", "user" and "todo" id, advanced past the generated rows
+    now: datetime the completion times are counted back from
+
+    ------
+    Returns
+    dict of table name -> list of row tuples in the column order of SEED_TABLES
+    """
+    rows = {model.__tablename__: [] for model, _ in SEED_TABLES}
+    archive_cutoff = now - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+
+    for _ in range(users):
+        user_id, address_id = ids["user"], ids["address"]
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city, state, country, postal_prefix = rng.choice(CITIES)
+
+        rows["address"].append((
+            address_id,
+            f"{rng.choice(STREETS)} {rng.randint(1, 200)}",
+            f"Floor {rng.randint(1, 8)}" if rng.random() < 0.3 else None,
+            city, state, country,
+            f"{postal_prefix}{rng.randint(0, 9999):04d}",
+            str(rng.randint(1, 120)) if rng.random() < 0.5 else None
+        ))
+        rows["users"].append((
+            user_id,
+            f"{first_name}.{last_name}.{user_id}@example.com".lower(),
+            f"{first_name}{last_name}{user_id}".lower(),
+            first_name, last_name, hashed_password,
+            rng.random() < 0.97,
+            f"+46 7{rng.randint(0, 9)} {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}",
+            address_id
+        ))
+
+        #A long tail: most users have a few todos, some have many.
+        counts = dict.fromkeys(todo_summary.COUNTER_COLUMNS, 0)
+
+        for _ in range(int(rng.expovariate(1 / todos_per_user)) if todos_per_user else 0):
+            todo = {"complete": rng.random() < COMPLETED_SHARE, "priority": rng.choices(todo_summary.PRIORITIES, PRIORITY_WEIGHTS)[0]}
+            completed_at = now - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400)) if todo["complete"] else None
+            row = (
+                ids["todo"],
+                f"{rng.choice(TODO_VERBS)} {rng.choice(TODO_OBJECTS)}",
+                rng.choice(TODO_DETAILS),
+                todo["priority"], todo["complete"], completed_at, user_id
+            )
+
+            if completed_at is not None and completed_at < archive_cutoff:
+                rows["todos_archive"].append(row + (completed_at + timedelta(days=config.ARCHIVE_AFTER_DAYS),))
+            else:
+                rows["todos"].append(row)
+
+            for column, count in todo_summary.todo_counts(todo).items():
+                counts[column] += count
+
+            ids["todo"] += 1
+
+        if any(counts.values()):
+            rows["todo_summary"].append((user_id,) + tuple(counts[column] for column in todo_summary.COUNTER_COLUMNS))
+
+        ids["user"] += 1
+        ids["address"] += 1
+
+    return rows
+
+
+def copy_rows(connection, table: str, columns: tuple, rows: list) -> None:
+    """Loads the rows with Postgres COPY, as csv (None is written as an empty unquoted field, which COPY reads as NULL)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table: str, columns: tuple, rows: list) -> None:
+    """Loads the rows with an executemany insert."""
+    model = next(model for model, _ in SEED_TABLES if model.__tablename__ == table)
+    connection.execute(insert(model.__table__), [dict(zip(columns, row)) for row in rows])
+
+
+def seed(users: int, todos_per_user: int, seed_value: int, batch_size: int, password: str) -> dict:
+    """
+    Generates and inserts the users (with an address each) and their todos, committing every batch_size users.
+
+    ------
+    Returns
+    dict of table name -> number of inserted rows
+    """
+    rng = random.Random(seed_value)
+    hashed_password = hash_password(password)
+    load = insert_rows if IS_SQLITE else copy_rows
+    now = datetime.utcnow()
+    inserted = {model.__tablename__: 0 for model, _ in SEED_TABLES}
+    engine = get_engine()
+
+    #The tables are otherwise created by the lifespan of the application, which may not have run on this database yet.
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.connect() as connection:
+        address_id, user_id, todo_id = next_ids(connection)
+
+    ids = {"address": address_id, "user": user_id, "todo": todo_id}
+
+    for start in range(0, users, batch_size):
+        rows = generate_batch(rng, min(batch_size, users - start), todos_per_user, hashed_password, ids, now)
+
+        with engine.begin() as connection:
+            for model, columns in SEED_TABLES:
+                table = model.__tablename__
+                if rows[table]:
+                    load(connection, table, columns, rows[table])
+                    inserted[table] += len(rows[table])
+
+        print(f"Seeded {start + len(rows['users'])}/{users} users")
+
+    if not IS_SQLITE:
+        #The rows were inserted with explicit ids, the sequences must continue after them.
+        with engine.begin() as connection:
+            for table, column, id_tables in SEQUENCES:
+                highest = ", ".join(f"(SELECT COALESCE(MAX({column}), 1) FROM {id_table})" for id_table in id_tables)
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), GREATEST({highest}))"
+                ))
+            connection.execute(text("ANALYZE"))
+
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database with generated users, addresses and todos")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--todos-per-user", type=int, default=20, help="average number of todos per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000, help="users generated and committed at once")
+    parser.add_argument("--password", default="password", help="password of every seeded user")
+    arguments = parser.parse_args()
+
+    started = time.perf_counter()
+    inserted = seed(arguments.users, arguments.todos_per_user, arguments.seed, arguments.batch_size, arguments.password)
+    print(f"Inserted {inserted} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,116 @@
+// Keeps the todo list up to date from the server-sent events of /todos/events.
+// Completing a todo is sent with fetch and the row is patched from the event, so the list is never reloaded for a one-row change.
+(function () {
+    var tbody = document.querySelector("tbody[data-live-todos]");
+
+    if (!tbody || !window.EventSource || !window.fetch) {
+        return;
+    }
+
+    function button(label, href, className) {
+        var element = document.createElement("button");
+        element.type = "button";
+        element.className = "btn " + className;
+        element.textContent = label;
+        element.setAttribute("onclick", "window.location.href='" + href + "'");
+        return element;
+    }
+
+    function renderRow(todo) {
+        var row = document.createElement("tr");
+        row.className = todo.complete ? "pointer alert alert-success" : "pointer";
+        row.setAttribute("data-todo-id", todo.todo_id);
+
+        var index = document.createElement("td");
+        var title = document.createElement("td");
+        var actions = document.createElement("td");
+
+        title.textContent = todo.title;
+        if (todo.complete) {
+            title.className = "strike-through-td";
+        }
+
+        var complete = button(todo.complete ? "Undo" : "Complete", "complete/" + todo.todo_id, "btn-success");
+        complete.setAttribute("data-complete", todo.todo_id);
+        actions.appendChild(complete);
+        actions.appendChild(document.createTextNode(" "));
+        actions.appendChild(button("Edit", "edit-todo/" + todo.todo_id, "btn-info"));
+
+        row.appendChild(index);
+        row.appendChild(title);
+        row.appendChild(actions);
+        return row;
+    }
+
+    function findRow(todoId) {
+        return tbody.querySelector("tr[data-todo-id='" + todoId + "']");
+    }
+
+    function renumber() {
+        var rows = tbody.querySelectorAll("tr[data-todo-id]");
+        for (var i = 0; i < rows.length; i++) {
+            rows[i].cells[0].textContent = i + 1;
+        }
+    }
+
+    function upsert(todo) {
+        var row = renderRow(todo);
+        var existing = findRow(todo.todo_id);
+
+        if (existing) {
+            tbody.replaceChild(row, existing);
+            return;
+        }
+
+        // The rows are sorted by todo_id.
+        var rows = tbody.querySelectorAll("tr[data-todo-id]");
+        for (var i = 0; i < rows.length; i++) {
+            if (Number(rows[i].getAttribute("data-todo-id")) > todo.todo_id) {
+                tbody.insertBefore(row, rows[i]);
+                return;
+            }
+        }
+        tbody.appendChild(row);
+    }
+
+    var events = new EventSource("/todos/events");
+
+    events.addEventListener("todo", function (message) {
+        var event = JSON.parse(message.data);
+
+        if (event.type === "upsert") {
+            upsert(event.todo);
+        } else if (event.type === "remove") {
+            var row = findRow(event.todo_id);
+            if (row) {
+                tbody.removeChild(row);
+            }
+        } else if (event.type === "reload") {
+            window.location.reload();
+            return;
+        }
+        renumber();
+    });
+
+    // Captured before the inline onclick of the button, which would navigate to the action.
+    tbody.addEventListener("click", function (click) {
+        var target = click.target.closest ? click.target.closest("[data-complete]") : null;
+
+        if (!target || events.readyState !== EventSource.OPEN) {
+            return;
+        }
+
+        click.stopPropagation();
+        target.disabled = true;
+
+        fetch("complete/" + target.getAttribute("data-complete"), {headers: {"X-Requested-With": "fetch"}})
+            .then(function (response) {
+                if (!response.ok) {
+                    window.location.reload();
+                }
+            })
+            .catch(function () {
+                window.location.reload();
+            });
+    }, true);
+})();
@@ -0,0 +1,110 @@
+"""
+Module for serving the static assets.
+If build_static.py has been run, the built directory is served: the precompressed variant of a file is picked
+by the Accept-Encoding header and fingerprinted files are cached by the browser "forever".
+Without a build the original static directory is served as before.
+"""
+
+import json
+import os
+import stat
+from mimetypes import guess_type
+from typing import Union
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+from . import config
+
+#Preferred order of the precompressed variants and their file suffix
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+#Fingerprinted files never change, un-fingerprinted files must be revalidated.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def load_manifest(directory: str) -> dict:
+    """
+    Reads the manifest written by build_static.py.
+
+    ------
+    Parameters
+    directory: str of the built static directory
+
+    ------
+    Returns
+    dict of original path -> fingerprinted path. Empty if the assets have not been built.
+    """
+    try:
+        with open(os.path.join(directory, config.STATIC_MANIFEST)) as file:
+            return json.load(file)
+
+    except FileNotFoundError:
+        return {}
+
+
+def static_directory() -> str:
+    """Returns the built directory if the assets have been built, otherwise the original static directory."""
+    if os.path.isfile(os.path.join(config.STATIC_BUILD_DIR, config.STATIC_MANIFEST)):
+        return config.STATIC_BUILD_DIR
+
+    return config.STATIC_DIR
+
+
+#original path -> fingerprinted path, used by the static_url template function.
+manifest = load_manifest(static_directory())
+
+
+def fingerprinted_path(path: str) -> str:
+    """
+    Returns the fingerprinted path of a static asset, or the path itself if the assets have not been built.
+
+    ------
+    Parameters
+    path: str of the path relative to the static mount, e.g. /todo/css/base.css
+    """
+    return "/" + manifest.get(path.lstrip("/"), path.lstrip("/"))
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.fingerprinted = set(manifest.values())
+
+    def _accepted_encodings(self, scope: Scope) -> list:
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        accepted = {value.split(";")[0].strip() for value in accept_encoding.split(",")}
+
+        return [(encoding, suffix) for encoding, suffix in ENCODINGS if encoding in accepted]
+
+    async def _compressed_response(self, path: str, scope: Scope) -> Union[Response, None]:
+        for encoding, suffix in self._accepted_encodings(scope):
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                media_type = guess_type(path)[0] or "text/plain"
+                response = FileResponse(full_path, stat_result=stat_result, media_type=media_type)
+                response.headers["Content-Encoding"] = encoding
+
+                if self.is_not_modified(response.headers, Headers(scope=scope)):
+                    return NotModifiedResponse(response.headers)
+
+                return response
+
+        return None
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await self._compressed_response(path, scope)
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            response.headers["Vary"] = "Accept-Encoding"
+            response.headers["Cache-Control"] = (
+                IMMUTABLE_CACHE_CONTROL if path.replace(os.sep, "/") in self.fingerprinted else REVALIDATE_CACHE_CONTROL
+            )
+
+        return response
@@ -0,0 +1,70 @@
+"""
+Module for the shared Jinja2 template environment.
+All routers render through the same environment so templates are compiled once per worker.
+In production the compiled bytecode is cached on disk and the filesystem is not checked for changes on every render.
+The environment (and Jinja2 itself) is set up on first use, at the latest when the worker starts (precompile_templates).
+"""
+
+import os
+from functools import lru_cache
+from .render_cache import RenderCache
+from .cache import versions
+from .static_files import fingerprinted_path
+from . import config
+
+
+def _bytecode_cache():
+    from jinja2 import FileSystemBytecodeCache
+
+    os.makedirs(config.TEMPLATE_CACHE_DIR, exist_ok=True)
+    return FileSystemBytecodeCache(directory=config.TEMPLATE_CACHE_DIR)
+
+
+def static_url(context, path: str):
+    """
+    Template function returning the url of a static asset. Points to the fingerprinted file if the assets have been built.
+
+    ------
+    Parameters
+    path: str of the path relative to the static mount, e.g. /todo/css/base.css
+    """
+    return context["request"].url_for("static", path=fingerprinted_path(path))
+
+
+@lru_cache(maxsize=None)
+def get_templates():
+    """Returns the shared Jinja2Templates, created on the first call."""
+    from fastapi.templating import Jinja2Templates
+    from jinja2 import pass_context
+
+    #In development templates are reloaded when changed. In production they are loaded once and the bytecode is reused across workers.
+    templates = Jinja2Templates(
+        directory=config.TEMPLATE_DIR,
+        auto_reload=config.DEBUG,
+        bytecode_cache=None if config.DEBUG else _bytecode_cache(),
+        cache_size=-1
+    )
+    templates.env.globals["static_url"] = pass_context(static_url)
+
+    return templates
+
+
+#Cache of rendered pages. Disabled in development so template changes show up right away.
+render_cache = RenderCache(get_templates, versions, max_entries=0 if config.DEBUG else 1024)
+
+
+def precompile_templates() -> int:
+    """
+    Compiles every template in the template directory so the first request does not pay for parsing and compiling.
+
+    ------
+    Returns
+    int of the number of compiled templates
+    """
+    environment = get_templates().env
+    names = environment.list_templates(extensions=["html"])
+
+    for name in names:
+        environment.get_template(name)
+
+    return len(names)
@@ -0,0 +1,139 @@
+"""
+Module for the todo counters of every user (the todo_summary table): open, completed and open by priority.
+
+The counters cover the hot and the archived todos, so archiving and restoring do not change them. The todo write paths
+apply the change of a todo to the counters in the same transaction as the write (record_change), and the
+reconciliation job recounts them in batches (reconcile), which corrects any drift.
+"""
+
+from typing import Union
+from sqlalchemy import func, select, text, union_all
+from . import models
+
+PRIORITIES = (1, 2, 3, 4, 5)
+
+COUNTER_COLUMNS = ("open_count", "completed_count") + tuple(f"open_priority_{priority}" for priority in PRIORITIES)
+
+#Adds the deltas to the owner's counters, creating the row for the first todo of the owner. One atomic statement, so
+#concurrent writes of one owner never lose an update (Postgres and SQLite both support ON CONFLICT).
+UPSERT_DELTAS_SQL = text(f"""
+    INSERT INTO todo_summary (owner_id, {", ".join(COUNTER_COLUMNS)})
+    VALUES (:owner_id, {", ".join(":" + column for column in COUNTER_COLUMNS)})
+    ON CONFLICT (owner_id) DO UPDATE SET
+    {", ".join(f"{column} = todo_summary.{column} + excluded.{column}" for column in COUNTER_COLUMNS)}
+""")
+
+#Replaces the owner's counters with recounted ones.
+UPSERT_COUNTS_SQL = text(f"""
+    INSERT INTO todo_summary (owner_id, {", ".join(COUNTER_COLUMNS)})
+    VALUES (:owner_id, {", ".join(":" + column for column in COUNTER_COLUMNS)})
+    ON CONFLICT (owner_id) DO UPDATE SET
+    {", ".join(f"{column} = excluded.{column}" for column in COUNTER_COLUMNS)}
+""")
+
+
+def todo_counts(todo: Union[dict, None]) -> dict:
+    """
+    Returns the counters a single todo adds to its owner's summary.
+
+    ------
+    Parameters
+    todo: dict with the complete and priority of the todo (see cache.todo_as_dict), None for no todo
+    """
+    if todo is None:
+        return {}
+
+    if todo["complete"]:
+        return {"completed_count": 1}
+
+    counts = {"open_count": 1}
+
+    if todo["priority"] in PRIORITIES:
+        counts[f"open_priority_{todo['priority']}"] = 1
+
+    return counts
+
+
+def record_change(db, owner_id: int, before: Union[dict, None], after: Union[dict, None]) -> None:
+    """
+    Applies the change of a todo to the owner's counters. To be called in the transaction of the write, the caller commits.
+
+    ------
+    Parameters
+    db: the database session
+    owner_id: int of the owner of the todo
+    before: dict of the todo before the write (see cache.todo_as_dict), None if it is created
+    after: dict of the todo after the write, None if it is deleted
+    """
+    before_counts = todo_counts(before)
+    after_counts = todo_counts(after)
+    deltas = {column: after_counts.get(column, 0) - before_counts.get(column, 0) for column in COUNTER_COLUMNS}
+
+    if any(deltas.values()):
+        db.execute(UPSERT_DELTAS_SQL, {"owner_id": owner_id, **deltas})
+
+
+def summary_as_dict(summary: Union[models.TodoSummary, None]) -> dict:
+    """Converts the owner's TodoSummary (None if the owner has never had a todo) to the response of the summary endpoint."""
+    return {
+        "open": summary.open_count if summary else 0,
+        "completed": summary.completed_count if summary else 0,
+        "open_by_priority": {str(priority): getattr(summary, f"open_priority_{priority}") if summary else 0 for priority in PRIORITIES}
+    }
+
+
+def count_todos(db, owner_ids: list) -> dict:
+    """
+    Counts the todos (hot and archived) of the owners.
+
+    ------
+    Returns
+    dict of owner_id -> dict of the counters (every counter column)
+    """
+    todos = union_all(
+        select(models.ToDos.owner_id, models.ToDos.complete, models.ToDos.priority).where(models.ToDos.owner_id.in_(owner_ids)),
+        select(models.TodosArchive.owner_id, models.TodosArchive.complete, models.TodosArchive.priority).where(models.TodosArchive.owner_id.in_(owner_ids))
+    ).subquery()
+
+    counts = {owner_id: dict.fromkeys(COUNTER_COLUMNS, 0) for owner_id in owner_ids}
+
+    for row in db.execute(select(todos.c.owner_id, todos.c.complete, todos.c.priority, func.count()).group_by(todos.c.owner_id, todos.c.complete, todos.c.priority)):
+        for column, count in todo_counts({"complete": row.complete, "priority": row.priority}).items():
+            counts[row.owner_id][column] += count * row[3]
+
+    return counts
+
+
+def reconcile(db, owner_ids: list) -> int:
+    """
+    Recounts the counters of the owners and corrects the ones that drifted, then commits.
+
+    The owners' summary rows are locked before the todos are counted: a write committed before the lock is in the count,
+    and a write still running adds its delta after the corrected counters are committed. Either way nothing is counted twice.
+
+    ------
+    Returns
+    int of the number of corrected summaries
+    """
+    current = {
+        summary.owner_id: summary
+        for summary in db.execute(
+            select(models.TodoSummary).where(models.TodoSummary.owner_id.in_(owner_ids)).with_for_update()
+        ).scalars()
+    }
+
+    corrected = 0
+
+    for owner_id, counts in count_todos(db, owner_ids).items():
+        summary = current.get(owner_id)
+
+        if summary is None and not any(counts.values()):
+            continue
+
+        if summary is None or any(getattr(summary, column) != count for column, count in counts.items()):
+            db.execute(UPSERT_COUNTS_SQL, {"owner_id": owner_id, **counts})
+            corrected += 1
+
+    db.commit()
+
+    return corrected
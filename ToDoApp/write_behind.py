@@ -0,0 +1,275 @@
+"""
+Module for the optional write-behind mode (WRITE_BEHIND=1).
+
+Instead of committing in the request, endpoints enqueue their write. A background task drains the queue and applies
+the writes in batched transactions, coalescing writes with the same key (e.g. several address updates of one user)
+so only the last one is applied.
+
+Every enqueued write is first appended to a local log file, so writes that were accepted but not yet committed are
+replayed when the application starts again. Each worker has its own log (suffixed with the pid) and takes over the logs
+of workers that are no longer running.
+"""
+
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+from typing import Callable, Union
+from .database import SessionLocal
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, log_path: str, batch_size: int, flush_interval: float, fsync: bool) -> None:
+        self.log_prefix = log_path
+        self.log_path = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        #op -> (apply(db, payload), key(payload) or None, after_commit(payload) or None)
+        self._handlers: dict = {}
+        self._queue: Union[asyncio.Queue, None] = None
+        self._task: Union[asyncio.Task, None] = None
+        self._log = None
+        self._seq = 0
+        self._stats = {"enqueued": 0, "applied": 0, "coalesced": 0, "failed": 0, "batches": 0, "last_flush_at": None, "last_batch_seconds": None}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def register(self, op: str, apply: Callable, key: Union[Callable, None] = None, after_commit: Union[Callable, None] = None) -> None:
+        """
+        Registers how an operation is applied.
+
+        ------
+        Parameters
+        op: str of the operation name used with enqueue
+        apply: callable(db, payload) adding the write to the session. The queue commits.
+        key: callable(payload) returning the coalescing key. Writes with the same key in one batch are applied only once (the last one).
+        after_commit: callable(payload) called once the batch containing the write is committed, e.g. to invalidate caches.
+        """
+        self._handlers[op] = (apply, key, after_commit)
+
+    def enqueue(self, op: str, payload: dict) -> None:
+        """
+        Appends the write to the log and queues it for the background task.
+
+        ------
+        Parameters
+        op: str of a registered operation
+        payload: json serializable dict of the write
+        """
+        if op not in self._handlers:
+            raise ValueError(f"Unknown write-behind operation {op}")
+
+        self._seq += 1
+        entry = {"seq": self._seq, "op": op, "payload": payload, "enqueued_at": time.time()}
+
+        self._log.write(json.dumps(entry) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+        self._queue.put_nowait(entry)
+        self._stats["enqueued"] += 1
+
+    async def start(self) -> None:
+        #The pid is taken at start, as workers may be forked after the module is imported.
+        self.log_path = f"{self.log_prefix}.{os.getpid()}"
+        self._queue = asyncio.Queue()
+        self._log = open(self.log_path, "a")
+        #Held for as long as the worker runs, so other workers know this log is not orphaned.
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        for entry in self._orphaned_entries():
+            self.enqueue(entry["op"], entry["payload"])
+
+        self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        """Waits until every queued write is committed."""
+        await self._queue.join()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        await self.flush()
+        self._task.cancel()
+        self._task = None
+
+        #Everything is committed, so the log is not needed for recovery.
+        self._log.close()
+        os.remove(self.log_path)
+        self._remove_checkpoint(self.log_path)
+
+    def metrics(self) -> dict:
+        """
+        Returns the queue metrics: counters, pending writes and the lag (age of the oldest pending write in seconds).
+        """
+        pending = self._queue.qsize() if self._queue else 0
+        oldest = self._queue._queue[0]["enqueued_at"] if pending else None
+
+        return {
+            **self._stats,
+            "enabled": self.running,
+            "pending": pending,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0
+        }
+
+    def _orphaned_entries(self) -> list:
+        """Reads the uncommitted entries of logs left by workers that are no longer running, and removes those logs."""
+        entries = []
+
+        for path in glob.glob(f"{self.log_prefix}.*"):
+            if path == self.log_path or ".checkpoint" in path:
+                continue
+
+            with open(path) as log:
+                try:
+                    fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    #Another worker is running with this log.
+                    continue
+
+                checkpoint = self._read_checkpoint(path)
+                for line in log:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry["seq"] > checkpoint:
+                            entries.append(entry)
+
+            os.remove(path)
+            self._remove_checkpoint(path)
+
+        if entries:
+            logger.warning("Replaying %d uncommitted write-behind entries", len(entries))
+
+        return entries
+
+    @staticmethod
+    def _read_checkpoint(path: str) -> int:
+        try:
+            with open(path + ".checkpoint") as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _remove_checkpoint(path: str) -> None:
+        try:
+            os.remove(path + ".checkpoint")
+        except FileNotFoundError:
+            pass
+
+    def _write_checkpoint(self, seq: int) -> None:
+        temporary_path = self.log_path + ".checkpoint.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(str(seq))
+        os.replace(temporary_path, self.log_path + ".checkpoint")
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _coalesce(self, batch: list) -> list:
+        latest = {}
+
+        for entry in batch:
+            apply, key, _ = self._handlers[entry["op"]]
+            coalesce_key = (entry["op"], key(entry["payload"])) if key else (entry["op"], "seq", entry["seq"])
+            latest[coalesce_key] = entry
+
+        self._stats["coalesced"] += len(batch) - len(latest)
+
+        return sorted(latest.values(), key=lambda entry: entry["seq"])
+
+    def _apply(self, entries: list) -> None:
+        db = SessionLocal()
+        try:
+            for entry in entries:
+                self._handlers[entry["op"]][0](db, entry["payload"])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _apply_batch(self, entries: list) -> list:
+        """Applies the entries in one transaction. If that fails they are applied one by one, so one bad write does not lose the batch."""
+        try:
+            self._apply(entries)
+            return entries
+        except Exception:
+            logger.exception("Write-behind batch failed, applying %d writes one by one", len(entries))
+
+        applied = []
+        for entry in entries:
+            try:
+                self._apply([entry])
+                applied.append(entry)
+            except Exception:
+                self._stats["failed"] += 1
+                logger.exception("Dropping write-behind entry %s", entry)
+
+        return applied
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._next_batch()
+            started = time.monotonic()
+
+            try:
+                applied = await loop.run_in_executor(None, self._apply_batch, self._coalesce(batch))
+
+                for entry in applied:
+                    after_commit = self._handlers[entry["op"]][2]
+                    if after_commit:
+                        try:
+                            after_commit(entry["payload"])
+                        except Exception:
+                            logger.exception("Write-behind after_commit failed for %s", entry)
+
+                self._stats["applied"] += len(applied)
+                self._stats["batches"] += 1
+                self._stats["last_flush_at"] = time.time()
+                self._stats["last_batch_seconds"] = round(time.monotonic() - started, 4)
+
+                #Nothing is pending, so the log can start over. Otherwise only the checkpoint moves forward.
+                if self._queue.empty():
+                    self._log.truncate(0)
+                    self._remove_checkpoint(self.log_path)
+                else:
+                    self._write_checkpoint(batch[-1]["seq"])
+
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+write_behind = WriteBehindQueue(
+    log_path=config.WRITE_BEHIND_LOG,
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=config.WRITE_BEHIND_INTERVAL_MS / 1000,
+    fsync=config.WRITE_BEHIND_FSYNC
+)
@@ -0,0 +1,102 @@
+"""
+Benchmark of the startup of a todo worker: importing ToDoApp.main in a fresh interpreter, as a new worker does.
+
+Reports the median wall time of the import, the modules of the package taking the most time (python -X importtime),
+and checks that the heavy components are not loaded at import (they are set up on first use or by the lifespan).
+Exits with status 1 if a heavy module is imported or the median exceeds --max-ms, so it can run as a check in CI.
+Usage (from the repository root): python benchmarks/bench_import.py --repeat 5 --max-ms 1000
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#Modules that must not be loaded by importing the application.
+LAZY_MODULES = ("jose", "passlib", "jinja2", "psycopg2", "redis")
+
+MEASURE_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import ToDoApp.main
+elapsed = time.perf_counter() - started
+print(elapsed)
+print(",".join(name for name in {lazy_modules!r} if name in sys.modules))
+"""
+
+
+def run(arguments: list, environment: dict) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + arguments, cwd=ROOT, env=environment, capture_output=True, text=True, check=True)
+
+
+def measure(repeat: int, environment: dict) -> tuple:
+    """
+    Imports the application in repeat fresh interpreters.
+
+    ------
+    Returns
+    tuple of (list of float seconds per import, list of str heavy modules loaded by the import)
+    """
+    timings = []
+    loaded = set()
+
+    for _ in range(repeat):
+        output = run(["-c", MEASURE_SCRIPT.format(lazy_modules=LAZY_MODULES)], environment).stdout.splitlines()
+        timings.append(float(output[0]))
+        loaded.update(name for name in output[1].split(",") if name)
+
+    return timings, sorted(loaded)
+
+
+def profile(environment: dict, top: int) -> list:
+    """
+    Returns the top modules by cumulative import time, as (microseconds, module) tuples.
+    """
+    stderr = run(["-X", "importtime", "-c", "import ToDoApp.main"], environment).stderr
+    rows = []
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, module = line.split("|")
+
+        if cumulative.strip().isdigit():
+            rows.append((int(cumulative), module.rstrip()))
+
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the todo application")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of modules shown in the profile")
+    parser.add_argument("--max-ms", type=float, default=0, help="fails if the median import takes longer, 0 disables the check")
+    arguments = parser.parse_args()
+
+    #The import must not touch the database, so any url works (sqlite keeps psycopg2 out of the measurement either way).
+    environment = {**os.environ, "DATABASE_URL": os.environ.get("DATABASE_URL", "sqlite:///./bench_import.db")}
+
+    timings, loaded = measure(arguments.repeat, environment)
+    median = statistics.median(timings) * 1000
+
+    print(f"import ToDoApp.main  median: {median:8.1f} ms   min: {min(timings) * 1000:8.1f} ms   ({arguments.repeat} runs)\n")
+    print("cumulative import time (top modules):")
+
+    for cumulative, module in profile(environment, arguments.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    failed = False
+
+    if loaded:
+        print(f"\nFAIL: imported at startup instead of on first use: {', '.join(loaded)}")
+        failed = True
+
+    if arguments.max_ms and median > arguments.max_ms:
+        print(f"\nFAIL: median import time {median:.1f} ms is above the budget of {arguments.max_ms:.0f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,86 @@
+"""
+Benchmark of the json serialization of large responses, before and after fast_responses.
+
+before: FastAPI's default path - jsonable_encoder followed by JSONResponse.render (json.dumps)
+after:  FastJSONResponse returned directly from the endpoint (orjson, no jsonable_encoder)
+
+Reports the serialization time and the bytes on the wire with and without the gzip middleware.
+Usage (from the repository root): python benchmarks/bench_json.py --rows 10000
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fast_responses import FastJSONResponse, GZIP_MINIMUM_SIZE, JSON_SERIALIZER
+from books2 import Book
+
+
+def make_books(rows: int) -> list:
+    return [
+        Book(
+            title=f"Title {i}",
+            author=f"Author {i % 500}",
+            genre=["Drama", "Action"] if i % 2 else ["Fantasy"],
+            description=f"Description of book number {i}",
+            rating=i % 101
+        )
+        for i in range(rows)
+    ]
+
+
+def make_users(rows: int) -> list:
+    #Same shape as the rows returned by GET /users/
+    return [
+        {
+            "user_id": i,
+            "email": f"user{i}@example.com",
+            "username": f"user{i}",
+            "first_name": "First",
+            "last_name": f"Last{i}",
+            "hashed_password": "$2b$12$" + "x" * 53,
+            "is_active": True,
+            "phone_number": f"+46 70 {i:07d}",
+            "address_id": None if i % 3 else i
+        }
+        for i in range(rows)
+    ]
+
+
+def wire_size(body: bytes) -> int:
+    #Mirrors the gzip middleware: compresslevel 9 and nothing below the threshold
+    if len(body) < GZIP_MINIMUM_SIZE:
+        return len(body)
+    return len(gzip.compress(body, compresslevel=9))
+
+
+def bench(name: str, payload: list, repeat: int) -> None:
+    before = lambda: JSONResponse(jsonable_encoder(payload)).body
+    after = lambda: FastJSONResponse(payload).body
+
+    before_time = min(timeit.repeat(before, number=1, repeat=repeat))
+    after_time = min(timeit.repeat(after, number=1, repeat=repeat))
+
+    before_body = before()
+    after_body = after()
+
+    print(f"{name} ({len(payload)} rows)")
+    print(f"  serialize  before: {before_time * 1000:8.2f} ms   after: {after_time * 1000:8.2f} ms   speedup: {before_time / after_time:5.1f}x")
+    print(f"  bytes      raw:    {len(before_body):8d}      gzip:  {wire_size(after_body):8d}      ratio:   {len(before_body) / wire_size(after_body):5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark json serialization and compression")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    print(f"serializer: {JSON_SERIALIZER}, gzip threshold: {GZIP_MINIMUM_SIZE} bytes\n")
+    bench("GET /books/", make_books(arguments.rows), arguments.repeat)
+    bench("GET /users/", make_users(arguments.rows), arguments.repeat)
@@ -1,9 +1,14 @@
 from fastapi import FastAPI, HTTPException, status
 from enum import Enum
 from typing import Union
+from fast_responses import FastJSONResponse, CompressionMiddleware
+from seed_books import BOOKS_SEED, BOOKS_SEED_COUNT, generate_books
 
 
-book_app = FastAPI()
+book_app = FastAPI(default_response_class=FastJSONResponse)
+
+#Compresses json responses above the size threshold
+book_app.add_middleware(CompressionMiddleware)
 
 
 BOOKS = {
@@ -25,6 +30,12 @@ BOOKS = {
         },
 }
 
+#Fills the shelf with generated books (BOOKS_SEED_COUNT), e.g. for benchmarks.
+BOOKS.update(
+    (f"book_{number}", {"title": book["title"], "author": book["author"]})
+    for number, book in enumerate(generate_books(BOOKS_SEED_COUNT, BOOKS_SEED), start=len(BOOKS) + 1)
+)
+
 
 #Enumerations are possible in FastAPI
 class DirectionName(str, Enum):
@@ -44,8 +55,8 @@ async def get_some_books(skip_book: Union[str, None] = None):
     if skip_book:
         new_book_shelf = BOOKS.copy()
         del new_book_shelf[skip_book]
-        return new_book_shelf
-    return BOOKS
+        return FastJSONResponse(new_book_shelf)
+    return FastJSONResponse(BOOKS)
 
 #Fetching using query params
 @book_app.get("/assignment/")
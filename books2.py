@@ -1,11 +1,19 @@
 from fastapi import FastAPI, Query, HTTPException, status, Request, Form, Header
-from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from uuid import UUID, uuid4
 from enum import Enum
 from typing import List, Union, Optional
+from fast_responses import FastJSONResponse, CompressionMiddleware
+from single_flight import single_flight
+from seed_books import BOOKS_SEED, BOOKS_SEED_COUNT, generate_books
+from shared_catalog import CatalogFullError, make_catalog
 
-book_api = FastAPI()
+book_api = FastAPI(default_response_class=FastJSONResponse)
+
+#Compresses json responses above the size threshold
+book_api.add_middleware(CompressionMiddleware)
 
 class Genre(str, Enum):
     drama = "Drama"
@@ -21,7 +29,8 @@ class NegativeNumberException(Exception):
 
 
 class Book(BaseModel):
-    book_id: Union[UUID, None] = uuid4()
+    #A new id per book, the catalog is keyed by it.
+    book_id: Union[UUID, None] = Field(default_factory=uuid4)
     title: str = Field(min_length=1)
     author: str = Field(min_length=1)
     genre: List[Genre]
@@ -73,7 +82,7 @@ class UpdateBook(BaseModel):
 
 
 
-BOOKS = [
+INITIAL_BOOKS = [
     Book(
         title="Romantic Book",
         author="Some old single lady",
@@ -95,6 +104,23 @@ BOOKS = [
     )
 ]
 
+
+def initial_records():
+    """
+    Yields the records (json-able dicts) of the initial books, followed by the generated books (BOOKS_SEED_COUNT),
+    e.g. for benchmarks. Those are valid by construction, so they are not validated.
+    """
+    for book in INITIAL_BOOKS:
+        yield jsonable_encoder(book)
+
+    for book in generate_books(BOOKS_SEED_COUNT, BOOKS_SEED):
+        yield {**book, "book_id": str(book["book_id"])}
+
+
+#The books, shared by every worker when BOOKS_SHARED_MEMORY is set (see shared_catalog.py).
+catalog = make_catalog(initial_records, expected_books=len(INITIAL_BOOKS) + BOOKS_SEED_COUNT)
+
+
 @book_api.exception_handler(NegativeNumberException)
 async def negative_number_exception_handler(request: Request,
                                             exception: NegativeNumberException):
@@ -107,38 +133,46 @@ async def negative_number_exception_handler(request: Request,
 @book_api.get("/books/")
 def read_all_books(limit_books: Optional[int] = Query(default=0)):
 
-    if limit_books == 0 or limit_books > len(BOOKS):
-        return BOOKS
+    #The catalog holds the books as json, so the body is joined from it without serializing anything.
+    if limit_books == 0 or limit_books > len(catalog):
+        return Response(catalog.body(), media_type="application/json")
 
     if limit_books and limit_books < 0:
         raise NegativeNumberException(books_to_return=limit_books)
     
-    return BOOKS[:limit_books]
+    return Response(catalog.body(limit_books), media_type="application/json")
 
 
 
+#Concurrent searches for the same book are answered by one lookup.
 @book_api.get("/books/search")
+@single_flight("fetch_book_by_id")
 def fetch_book_by_id(book_id: UUID):
-    for book in BOOKS:
-        if book.book_id == book_id:
-            return book
+    book = catalog.get(book_id)
+
+    if book is not None:
+        return book
     
     raise item_not_found_exception(book_id)
 
 #Using BookNoRating as response model
 @book_api.get("/books/no_rating/search", response_model=BookNoRating)
 def fetch_no_rating_book_by_id(book_id: UUID):
-    for book in BOOKS:
-        if book.book_id == book_id:
-            return book
+    book = catalog.get(book_id)
+
+    if book is not None:
+        return book
     
     raise item_not_found_exception(book_id)
 
 
 #Adding custom HTTP response. 201 is better for post requests as it states something was created.
 @book_api.post("/books/", status_code=status.HTTP_201_CREATED)
-async def add_book(add_book: Book):
-    BOOKS.append(add_book)
+def add_book(add_book: Book):
+    try:
+        catalog.put(jsonable_encoder(add_book))
+    except CatalogFullError:
+        raise catalog_full_exception()
 
     return {"book_added": add_book}
 
@@ -161,37 +195,31 @@ async def fetch_book_auth(book_id: UUID, username: str = Header(), password: str
     if (username != "FastAPIUser" or password != "test1234!"):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid user")
     else:
-        for book in BOOKS:
-            if book.book_id == book_id:
-                return book
+        return catalog.get(book_id)
 
 
 @book_api.put("/books/")
-async def update_book(updated_book: UpdateBook):
-    for book in BOOKS:
-        if book.book_id == updated_book.book_id:
-            if updated_book.author:
-                book.author = updated_book.author
-            if updated_book.title:
-                book.title = updated_book.title
-            if updated_book.genre:
-                book.genre = updated_book.genre
-            if updated_book.description:
-                book.description = updated_book.description
-            if updated_book.rating:
-                book.rating = updated_book.rating
-            
-            return {"message": "Book was updated"}
+def update_book(updated_book: UpdateBook):
+    #Only the given fields are changed.
+    changes = {field: value for field, value in jsonable_encoder(updated_book, exclude={"book_id"}).items() if value}
+
+    try:
+        updated = updated_book.book_id is not None and catalog.update(updated_book.book_id, changes)
+    except CatalogFullError:
+        raise catalog_full_exception()
+
+    if updated:
+        return {"message": "Book was updated"}
+
     raise item_not_found_exception(updated_book.book_id)
 
 
 @book_api.delete("/books/{book_id}")
 def delete_book(book_id: UUID):
-    for book in BOOKS:
-        if book.book_id == book_id:
-            BOOKS.remove(book)
+    book = catalog.delete(book_id)
 
-            return {"Deleted": book}
+    if book is not None:
+        return {"Deleted": book}
     raise item_not_found_exception(book_id)
         
 
@@ -200,4 +228,10 @@ def delete_book(book_id: UUID):
 def item_not_found_exception(book_id: UUID):
     return HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
         detail=f"Book with id {book_id} not in inventory",
-        headers={"X-Header-Error": "Nothing with that UUID"}) 
\ No newline at end of file
+        headers={"X-Header-Error": "Nothing with that UUID"}) 
+
+
+#The shared catalog has no room left for the book (see BOOKS_SHARED_MEMORY_MB and BOOKS_INDEX_SLOTS).
+def catalog_full_exception():
+    return HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+        detail="The book catalog is full, no more books can be added or enlarged")
@@ -0,0 +1,104 @@
+"""
+Fast JSON responses and response compression shared by book_app, book_api and todo_api.
+
+FastJSONResponse serializes with orjson when it is installed (select with the JSON_SERIALIZER env var, "orjson" or "json")
+and understands pydantic models and SQLAlchemy ORM objects/rows. Returning it directly from an endpoint skips
+FastAPI's jsonable_encoder pass, which is the most expensive part of serializing large lists.
+"""
+
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any
+from uuid import UUID
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_SERIALIZER = os.environ.get("JSON_SERIALIZER", "orjson" if orjson else "json")
+
+#Responses smaller than this (in bytes) are sent uncompressed - the gzip framing would cost more than it saves.
+GZIP_MINIMUM_SIZE = int(os.environ.get("GZIP_MINIMUM_SIZE", "1000"))
+
+
+def to_jsonable(obj: Any) -> Any:
+    """
+    Converts the objects the json encoders do not understand natively.
+    Used as the "default" hook, so it is only called for those objects and not for every value.
+
+    ------
+    Parameters
+    obj: a pydantic model, SQLAlchemy ORM object, SQLAlchemy Row or a simple type (UUID, datetime, Enum, Decimal, set)
+
+    ------
+    Returns
+    A json serializable version of the object
+    """
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+
+    #SQLAlchemy ORM objects - only the column attributes, so relationships are never lazy loaded.
+    mapper = getattr(obj, "__mapper__", None)
+    if mapper is not None:
+        return {attribute.key: getattr(obj, attribute.key) for attribute in mapper.column_attrs}
+
+    #SQLAlchemy Row from a projected query, e.g. db.query(Users.user_id, Users.username)
+    if hasattr(obj, "_asdict"):
+        return obj._asdict()
+
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (UUID, Decimal)):
+        return str(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializes the content to json bytes with the selected serializer."""
+    if JSON_SERIALIZER == "orjson" and orjson is not None:
+        return orjson.dumps(content, default=to_jsonable, option=orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(
+        content,
+        default=to_jsonable,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZip middleware that leaves the given path prefixes alone, e.g. the static files which are already precompressed
+    and streaming endpoints which must not be buffered.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = GZIP_MINIMUM_SIZE, exclude_prefixes: tuple = ()) -> None:
+        super().__init__(app, minimum_size=minimum_size)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.exclude_prefixes and scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        await super().__call__(scope, receive, send)
+
@@ -0,0 +1,47 @@
+"""
+Deterministic generator of realistic books for the in-memory stores of book_app (books.py) and book_api (books2.py).
+
+The stores are filled at import when BOOKS_SEED_COUNT is set, e.g.
+    BOOKS_SEED_COUNT=1000000 BOOKS_SEED=42 uvicorn books2:book_api
+The same count and seed always give the same books (ids included), so benchmark runs are comparable.
+"""
+
+import os
+import random
+from typing import Iterator
+from uuid import UUID
+
+BOOKS_SEED_COUNT = int(os.environ.get("BOOKS_SEED_COUNT", "0"))
+BOOKS_SEED = int(os.environ.get("BOOKS_SEED", "42"))
+
+GENRES = ("Drama", "Action", "Romance", "Sci-Fi", "Fantasy")
+
+TITLE_ADJECTIVES = ("Silent", "Last", "Broken", "Hidden", "Golden", "Distant", "Burning", "Forgotten", "Endless", "Crimson", "Lonely", "Savage")
+TITLE_NOUNS = ("Kingdom", "River", "Promise", "Empire", "Garden", "Storm", "Winter", "Machine", "Letter", "Island", "Shadow", "Harbor")
+FIRST_NAMES = ("Anna", "Erik", "Maria", "Lars", "Sofia", "Johan", "Emma", "Karl", "Ingrid", "Olof", "Elsa", "Nils", "Astrid", "Gustav")
+LAST_NAMES = ("Lindqvist", "Berg", "Nilsson", "Holm", "Ek", "Strand", "Dahl", "Sjöberg", "Lund", "Wallin", "Forsberg", "Hedlund")
+DESCRIPTION_PHRASES = ("A story of loss and hope", "Nothing is what it seems", "One last chance to set it right",
+                       "The end of an era", "Friends become enemies", "A journey across the world")
+
+
+def generate_books(count: int, seed: int = BOOKS_SEED) -> Iterator[dict]:
+    """
+    Yields count books as dicts with the fields of books2.Book.
+
+    ------
+    Parameters
+    count: int of the number of books
+    seed: int of the random seed
+    """
+    rng = random.Random(seed)
+
+    for number in range(count):
+        yield {
+            "book_id": UUID(int=rng.getrandbits(128), version=4),
+            "title": f"The {rng.choice(TITLE_ADJECTIVES)} {rng.choice(TITLE_NOUNS)} {number}",
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "genre": rng.sample(GENRES, rng.choice((1, 1, 2, 3))),
+            "description": rng.choice(DESCRIPTION_PHRASES) if rng.random() < 0.9 else None,
+            #Ratings cluster around 70, like real review scores.
+            "rating": min(100, max(0, int(rng.gauss(70, 15)))) if rng.random() < 0.8 else None
+        }
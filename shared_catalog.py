@@ -0,0 +1,530 @@
+"""
+Book catalog of book_api, shared by its workers.
+
+Every uvicorn worker used to keep its own BOOKS list: a book added through one worker was invisible to the others, and
+the catalog was held once per worker. With BOOKS_SHARED_MEMORY set to a segment name (e.g. books2_catalog) the catalog
+lives in one multiprocessing.shared_memory segment mapped by every worker:
+
+    header | index (open addressing, book_id -> record offset) | records (json, in list order)
+
+Writes are serialized by a file lock (one writer at a time across the workers, plus a thread lock within a worker).
+Readers never lock: the writer makes the version counter odd while it changes the segment and even again when it is done
+(a seqlock), and a reader that saw the version change during its read reads again. The version also tells every worker
+when its cached body of the whole catalog is stale.
+
+An updated book stays in place if it fits its record, otherwise it moves to the end of the list. Deleted and moved records
+are reclaimed by compacting the segment when it is full. The first worker creates the segment and fills it with the
+initial books, the others attach to it. The segment outlives the workers, so a restart keeps the catalog:
+python shared_catalog.py --unlink removes it.
+
+Without BOOKS_SHARED_MEMORY the catalog is a dict in the worker, as before (fine for a single worker).
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock
+from typing import Callable, Iterable, Union
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#Name of the shared memory segment, empty keeps the catalog in each worker.
+BOOKS_SHARED_MEMORY = os.environ.get("BOOKS_SHARED_MEMORY", "")
+#Least size of the segment and slots of the index (at most INDEX_MAX_LOAD of them hold books). Both grow to fit the expected
+#books (see catalog_dimensions), and are only used when the segment is created.
+BOOKS_SHARED_MEMORY_MB = int(os.environ.get("BOOKS_SHARED_MEMORY_MB", "256"))
+BOOKS_INDEX_SLOTS = int(os.environ.get("BOOKS_INDEX_SLOTS", str(1 << 20)))
+#The body of the whole catalog is cached per worker up to this size, larger catalogs are serialized per request.
+BOOKS_BODY_CACHE_MAX_BYTES = int(os.environ.get("BOOKS_BODY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+MAGIC = b"BOOKSHM1"
+#magic, version, number of books, end of the records, index slots, bytes of dead records, removed index slots
+HEADER = struct.Struct("<8sQQQQQQ")
+HEADER_SIZE = 64
+VERSION_OFFSET = 8
+#book_id (uuid bytes), offset of the record. Offset 0 is an empty slot, 1 a removed one.
+SLOT = struct.Struct("<16sQ")
+EMPTY, REMOVED = 0, 1
+INDEX_MAX_LOAD = 0.7
+#capacity, length of the json, live flag
+RECORD = struct.Struct("<IIB")
+#Room planned per book when sizing the segment: a generated book takes about 260 bytes with the room to grow of its record.
+BOOK_BYTES = 384
+#Share of books that may be added on top of the expected ones before the catalog is full.
+GROWTH_HEADROOM = 0.25
+
+#A reader waiting this long for a writer takes the write lock, in case the writer died halfway (see _recover).
+READ_RECOVERY_SECONDS = 1.0
+
+
+class CatalogFullError(Exception):
+    pass
+
+
+def dumps(record: dict) -> bytes:
+    if orjson:
+        return orjson.dumps(record)
+
+    return json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+
+def loads(payload: bytes) -> dict:
+    return orjson.loads(payload) if orjson else json.loads(payload)
+
+
+def book_key(book_id: Union[UUID, str]) -> str:
+    return str(UUID(str(book_id)))
+
+
+class LocalCatalog:
+    """The catalog of a single worker, a dict of book_id -> record (the json-able dict of a book) in list order."""
+
+    def __init__(self, initial: Callable[[], Iterable[dict]]) -> None:
+        self._books = {book_key(record["book_id"]): record for record in initial()}
+        self.version = 0
+        self._body = (None, b"")
+
+    def __len__(self) -> int:
+        return len(self._books)
+
+    def get(self, book_id: Union[UUID, str]) -> Union[dict, None]:
+        return self._books.get(book_key(book_id))
+
+    def body(self, limit: int = 0) -> bytes:
+        """Returns the json array of the first limit books (every book if limit is 0)."""
+        if limit:
+            return b"[" + b",".join(dumps(record) for record in list(self._books.values())[:limit]) + b"]"
+
+        if self._body[0] != self.version:
+            self._body = (self.version, b"[" + b",".join(dumps(record) for record in self._books.values()) + b"]")
+
+        return self._body[1]
+
+    def put(self, record: dict) -> None:
+        """Adds the book, or replaces the book with the same book_id."""
+        self._books[book_key(record["book_id"])] = record
+        self.version += 2
+
+    def update(self, book_id: Union[UUID, str], changes: dict) -> bool:
+        record = self.get(book_id)
+
+        if record is None:
+            return False
+
+        record.update(changes)
+        self.version += 2
+
+        return True
+
+    def delete(self, book_id: Union[UUID, str]) -> Union[dict, None]:
+        record = self._books.pop(book_key(book_id), None)
+
+        if record is not None:
+            self.version += 2
+
+        return record
+
+    def stats(self) -> dict:
+        return {"backend": "local", "books": len(self), "version": self.version}
+
+
+class SharedMemoryCatalog:
+    """The catalog in a shared memory segment, see the module docstring for the layout and the protocol."""
+
+    def __init__(self,
+                 name: str,
+                 size: int,
+                 index_slots: int,
+                 initial: Callable[[], Iterable[dict]],
+                 lock_path: Union[str, None] = None) -> None:
+        self.name = name
+        self._thread_lock = Lock()
+        self._lock_file = open(lock_path or os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a")
+        self._body = (None, b"")
+
+        with self._locked():
+            try:
+                self._shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+            #The segment belongs to every worker, the resource tracker must not remove it when this one exits.
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+            self._buf = self._shm.buf
+
+            #Created now, or its creator died before it was filled.
+            if bytes(self._buf[:len(MAGIC)]) != MAGIC:
+                self._initialize(index_slots, initial())
+
+            #A writer died halfway: the catalog is left as it was written, readers must not wait for it.
+            if self.version % 2:
+                self._set_version(self.version + 1)
+
+        self.index_slots = self._header()[4]
+        self.data_start = HEADER_SIZE + self.index_slots * SLOT.size
+
+    #Header
+
+    def _header(self) -> tuple:
+        return HEADER.unpack_from(self._buf, 0)
+
+    def _set_header(self, count: int, data_end: int, dead_bytes: int, removed_slots: int) -> None:
+        magic, version, _, _, index_slots, _, _ = self._header()
+        HEADER.pack_into(self._buf, 0, magic, version, count, data_end, index_slots, dead_bytes, removed_slots)
+
+    @property
+    def version(self) -> int:
+        return struct.unpack_from("<Q", self._buf, VERSION_OFFSET)[0]
+
+    def _set_version(self, version: int) -> None:
+        struct.pack_into("<Q", self._buf, VERSION_OFFSET, version)
+
+    def __len__(self) -> int:
+        return self._header()[2]
+
+    #Locking
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        """Holds the write lock, with the version odd while the segment is changed."""
+        with self._locked():
+            self._set_version(self.version + 1)
+            try:
+                yield
+            finally:
+                self._set_version(self.version + 1)
+
+    def _read(self, func: Callable):
+        """Runs func (reading the segment) until it ran without a write in between, and returns its result."""
+        started = time.monotonic()
+
+        while True:
+            version = self.version
+
+            if version % 2 == 0:
+                try:
+                    result = func()
+                except Exception:
+                    #A torn read may decode garbage. It is only an error if nothing was written meanwhile.
+                    if self.version == version:
+                        raise
+                else:
+                    if self.version == version:
+                        return result
+
+            if time.monotonic() - started > READ_RECOVERY_SECONDS:
+                self._recover()
+                started = time.monotonic()
+
+            time.sleep(0)
+
+    def _recover(self) -> None:
+        #The write lock is free if the writer died (flock is released with its process), its version is then left odd.
+        with self._locked():
+            if self.version % 2:
+                self._set_version(self.version + 1)
+
+    #Index and records
+
+    def _slot_offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * SLOT.size
+
+    def _probe(self, key: bytes) -> tuple:
+        """
+        Returns (slot of the book or None, slot a new book with this key goes to).
+        """
+        first_free = None
+        slot = int.from_bytes(key[:8], "little") % self.index_slots
+
+        for _ in range(self.index_slots):
+            slot_key, offset = SLOT.unpack_from(self._buf, self._slot_offset(slot))
+
+            if offset == EMPTY:
+                return None, slot if first_free is None else first_free
+
+            if offset == REMOVED:
+                if first_free is None:
+                    first_free = slot
+            elif slot_key == key:
+                return slot, slot
+
+            slot = (slot + 1) % self.index_slots
+
+        return None, first_free
+
+    def _record_offset(self, slot: int) -> int:
+        return SLOT.unpack_from(self._buf, self._slot_offset(slot))[1]
+
+    def _payload(self, offset: int) -> bytes:
+        _, length, _ = RECORD.unpack_from(self._buf, offset)
+        start = offset + RECORD.size
+        return bytes(self._buf[start:start + length])
+
+    def _records(self, limit: int = 0) -> list:
+        """Returns the json of the live records in list order, the first limit of them if limit is set."""
+        payloads = []
+        offset = self.data_start
+        data_end = self._header()[3]
+
+        while offset < data_end:
+            capacity, length, live = RECORD.unpack_from(self._buf, offset)
+
+            if live:
+                payloads.append(bytes(self._buf[offset + RECORD.size:offset + RECORD.size + length]))
+
+                if limit and len(payloads) >= limit:
+                    break
+
+            offset += RECORD.size + capacity
+
+        return payloads
+
+    def _append(self, payload: bytes) -> int:
+        """Writes the payload after the last record and returns its offset. The caller updates the header."""
+        #Room to grow, so most updates stay in place and keep the book's position in the list.
+        capacity = (len(payload) + len(payload) // 4 + 15) & ~7
+        _, _, count, data_end, _, dead_bytes, removed_slots = self._header()
+
+        if data_end + RECORD.size + capacity > self._shm.size:
+            raise CatalogFullError(f"The shared catalog {self.name} is full ({self._shm.size} bytes)")
+
+        RECORD.pack_into(self._buf, data_end, capacity, len(payload), 1)
+        self._buf[data_end + RECORD.size:data_end + RECORD.size + len(payload)] = payload
+        self._set_header(count, data_end + RECORD.size + capacity, dead_bytes, removed_slots)
+
+        return data_end
+
+    def _kill(self, offset: int) -> None:
+        capacity, length, _ = RECORD.unpack_from(self._buf, offset)
+        RECORD.pack_into(self._buf, offset, capacity, length, 0)
+        _, _, count, data_end, _, dead_bytes, removed_slots = self._header()
+        self._set_header(count, data_end, dead_bytes + RECORD.size + capacity, removed_slots)
+
+    def _put(self, record: dict) -> None:
+        key = UUID(str(record["book_id"])).bytes
+        payload = dumps(record)
+        found, free = self._probe(key)
+
+        if found is not None:
+            offset = self._record_offset(found)
+            capacity, _, _ = RECORD.unpack_from(self._buf, offset)
+
+            if len(payload) <= capacity:
+                RECORD.pack_into(self._buf, offset, capacity, len(payload), 1)
+                self._buf[offset + RECORD.size:offset + RECORD.size + len(payload)] = payload
+                return
+
+            self._ensure_room(len(payload), new_book=False)
+            #Compacting moved the records.
+            found, _ = self._probe(key)
+            moved = self._append(payload)
+            self._kill(self._record_offset(found))
+            SLOT.pack_into(self._buf, self._slot_offset(found), key, moved)
+            return
+
+        self._ensure_room(len(payload), new_book=True)
+        #Compacting rebuilt the index.
+        _, free = self._probe(key)
+        offset = self._append(payload)
+        SLOT.pack_into(self._buf, self._slot_offset(free), key, offset)
+        _, _, count, data_end, _, dead_bytes, removed_slots = self._header()
+        self._set_header(count + 1, data_end, dead_bytes, removed_slots)
+
+    def _ensure_room(self, length: int, new_book: bool) -> None:
+        _, _, count, data_end, index_slots, dead_bytes, removed_slots = self._header()
+        needed = RECORD.size + length * 2 + 16
+
+        if new_book and count + 1 > index_slots * INDEX_MAX_LOAD:
+            raise CatalogFullError(f"The index of the shared catalog {self.name} is full ({index_slots} slots)")
+
+        if data_end + needed > self._shm.size or (new_book and count + removed_slots + 1 > index_slots * INDEX_MAX_LOAD):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rewrites the live records back to back and rebuilds the index without the removed slots."""
+        payloads = self._records()
+        self._buf[HEADER_SIZE:self.data_start] = bytes(self.data_start - HEADER_SIZE)
+        self._set_header(0, self.data_start, 0, 0)
+
+        for payload in payloads:
+            key = UUID(loads(payload)["book_id"]).bytes
+            _, free = self._probe(key)
+            SLOT.pack_into(self._buf, self._slot_offset(free), key, self._append(payload))
+
+        _, _, _, data_end, _, _, _ = self._header()
+        self._set_header(len(payloads), data_end, 0, 0)
+
+    def _initialize(self, index_slots: int, initial: Iterable[dict]) -> None:
+        data_start = HEADER_SIZE + index_slots * SLOT.size
+
+        if data_start >= self._shm.size:
+            raise CatalogFullError(f"The shared catalog {self.name} is too small for {index_slots} index slots")
+
+        self._buf[:data_start] = bytes(data_start)
+        HEADER.pack_into(self._buf, 0, bytes(len(MAGIC)), 0, 0, data_start, index_slots, 0, 0)
+        self.index_slots = index_slots
+        self.data_start = data_start
+
+        for record in initial:
+            self._put(record)
+
+        #Written last, so a segment whose creator died while filling it is filled again.
+        self._buf[:len(MAGIC)] = MAGIC
+
+    #Catalog
+
+    def get(self, book_id: Union[UUID, str]) -> Union[dict, None]:
+        key = UUID(str(book_id)).bytes
+
+        def read():
+            found, _ = self._probe(key)
+            return None if found is None else self._payload(self._record_offset(found))
+
+        payload = self._read(read)
+
+        return None if payload is None else loads(payload)
+
+    def body(self, limit: int = 0) -> bytes:
+        """Returns the json array of the first limit books (every book if limit is 0), straight from the records."""
+        if limit:
+            return b"[" + b",".join(self._read(lambda: self._records(limit))) + b"]"
+
+        version, body = self._body
+
+        if version == self.version:
+            return body
+
+        #The version is read with the records, so the body is never cached under a newer version than its content.
+        version, payloads = self._read(lambda: (self.version, self._records()))
+        body = b"[" + b",".join(payloads) + b"]"
+
+        if len(body) <= BOOKS_BODY_CACHE_MAX_BYTES:
+            self._body = (version, body)
+
+        return body
+
+    def put(self, record: dict) -> None:
+        """Adds the book, or replaces the book with the same book_id."""
+        with self._writing():
+            self._put(record)
+
+    def update(self, book_id: Union[UUID, str], changes: dict) -> bool:
+        """Applies the changes to the book in one write, so concurrent updates of a book are not lost."""
+        with self._writing():
+            found, _ = self._probe(UUID(str(book_id)).bytes)
+
+            if found is None:
+                return False
+
+            record = loads(self._payload(self._record_offset(found)))
+            record.update(changes)
+            self._put(record)
+
+        return True
+
+    def delete(self, book_id: Union[UUID, str]) -> Union[dict, None]:
+        key = UUID(str(book_id)).bytes
+
+        with self._writing():
+            found, _ = self._probe(key)
+
+            if found is None:
+                return None
+
+            offset = self._record_offset(found)
+            record = loads(self._payload(offset))
+            self._kill(offset)
+            SLOT.pack_into(self._buf, self._slot_offset(found), key, REMOVED)
+            _, _, count, data_end, _, dead_bytes, removed_slots = self._header()
+            self._set_header(count - 1, data_end, dead_bytes, removed_slots + 1)
+
+        return record
+
+    def stats(self) -> dict:
+        _, version, count, data_end, index_slots, dead_bytes, removed_slots = self._header()
+
+        return {
+            "backend": "shared_memory",
+            "name": self.name,
+            "books": count,
+            "version": version,
+            "size": self._shm.size,
+            "used_bytes": data_end,
+            "dead_bytes": dead_bytes,
+            "index_slots": index_slots,
+            "index_load": round((count + removed_slots) / index_slots, 3)
+        }
+
+
+def catalog_dimensions(expected_books: int) -> tuple:
+    """
+    Returns the size and index slots of a segment holding the expected books, with room for GROWTH_HEADROOM more:
+    the index keeps its load under INDEX_MAX_LOAD (rounded up to a power of two), and the records get BOOK_BYTES each.
+    BOOKS_SHARED_MEMORY_MB and BOOKS_INDEX_SLOTS are the least size and slots.
+
+    ------
+    Returns
+    tuple of (int bytes of the segment, int slots of the index)
+    """
+    books = int(expected_books * (1 + GROWTH_HEADROOM))
+    index_slots = max(BOOKS_INDEX_SLOTS, 1 << max(0, int(books / INDEX_MAX_LOAD)).bit_length())
+    size = max(BOOKS_SHARED_MEMORY_MB * 1024 * 1024, HEADER_SIZE + index_slots * SLOT.size + books * BOOK_BYTES)
+
+    return size, index_slots
+
+
+def make_catalog(initial: Callable[[], Iterable[dict]], expected_books: int = 0) -> Union[LocalCatalog, SharedMemoryCatalog]:
+    """
+    Returns the catalog of the worker.
+
+    ------
+    Parameters
+    initial: callable returning the records of the initial books. With shared memory it is only called by the worker
+             creating the segment.
+    expected_books: int of the number of initial books, the shared segment is sized to hold them (see catalog_dimensions)
+    """
+    if BOOKS_SHARED_MEMORY:
+        size, index_slots = catalog_dimensions(expected_books)
+        return SharedMemoryCatalog(BOOKS_SHARED_MEMORY, size, index_slots, initial)
+
+    return LocalCatalog(initial)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or remove the shared book catalog")
+    parser.add_argument("--name", default=BOOKS_SHARED_MEMORY or "books2_catalog")
+    parser.add_argument("--unlink", action="store_true", help="remove the segment (the next worker creates it again)")
+    arguments = parser.parse_args()
+
+    try:
+        segment = shared_memory.SharedMemory(name=arguments.name)
+    except FileNotFoundError:
+        print(f"No shared catalog named {arguments.name}")
+    else:
+        if arguments.unlink:
+            #Also unregisters it from the resource tracker.
+            segment.unlink()
+            print(f"Removed the shared catalog {arguments.name}")
+        else:
+            resource_tracker.unregister(segment._name, "shared_memory")
+            print(SharedMemoryCatalog(arguments.name, segment.size, BOOKS_INDEX_SLOTS, list).stats())
+        segment.close()
@@ -0,0 +1,153 @@
+"""
+Single-flight for read endpoints, shared by book_api and todo_api.
+
+When several identical requests arrive while the first one is still running, only the first one executes the endpoint.
+The others wait for its result (at most max_wait seconds, then they execute it themselves) and all of them answer with it,
+errors included. Opt in per route by decorating the endpoint, below the route decorator:
+
+    @router.get("/user/{user_id}")
+    @single_flight("get_user")
+    async def get_user(user_id: int, ...):
+
+Only use it on endpoints whose result is the same for every caller with the same arguments (the key), and never on
+streaming responses. The key is built from the simple arguments of the endpoint (str, int, float, bool, UUID, None),
+dependencies like the database session or the request are left out unless a key function is given.
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+from typing import Any, Callable, Hashable, Union
+from uuid import UUID
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+
+#How long a collapsed request waits for the running one before executing the endpoint itself.
+SINGLE_FLIGHT_MAX_WAIT = float(os.environ.get("SINGLE_FLIGHT_MAX_WAIT", "5"))
+
+#Argument types that are part of the default key.
+KEY_TYPES = (str, int, float, bool, UUID, type(None))
+
+
+def clone_response(response: Any) -> Any:
+    """
+    Returns a copy of the response for another request: a response object is sent once and its headers may be changed
+    by the caller (e.g. cookies), so every request gets its own. Anything else (dicts, models) is serialized per request and shared.
+    """
+    if not isinstance(response, Response) or isinstance(response, StreamingResponse):
+        return response
+
+    clone = Response(content=response.body, status_code=response.status_code)
+    clone.raw_headers = list(response.raw_headers)
+
+    return clone
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        #key -> future of the running execution
+        self._calls: dict = {}
+        self._stats: dict = {}
+
+    def _route_stats(self, name: str) -> dict:
+        if name not in self._stats:
+            self._stats[name] = {"executions": 0, "collapsed": 0, "timeouts": 0, "errors": 0}
+
+        return self._stats[name]
+
+    async def do(self, name: str, key: Hashable, func: Callable, max_wait: float) -> Any:
+        """
+        Executes func, or waits for the running execution with the same key and returns its result.
+
+        ------
+        Parameters
+        name: str of the route, for the stats
+        key: hashable key of identical calls
+        func: async callable without arguments executing the endpoint
+        max_wait: float of the seconds waited for a running execution
+        """
+        stats = self._route_stats(name)
+        running = self._calls.get((name, key))
+
+        if running is not None:
+            stats["collapsed"] += 1
+
+            try:
+                return clone_response(await asyncio.wait_for(asyncio.shield(running), max_wait))
+            except asyncio.TimeoutError:
+                stats["timeouts"] += 1
+            except asyncio.CancelledError:
+                #The running execution was cancelled (its client went away), not this request.
+                if not running.cancelled():
+                    raise
+
+            stats["executions"] += 1
+            return await func()
+
+        future = asyncio.get_running_loop().create_future()
+        #Marks the exception as retrieved, in case nobody was waiting for it.
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._calls[(name, key)] = future
+        stats["executions"] += 1
+
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except Exception as exception:
+            stats["errors"] += 1
+            future.set_exception(exception)
+            raise
+
+        finally:
+            del self._calls[(name, key)]
+
+    def stats(self) -> dict:
+        return {name: {**stats, "in_flight": sum(1 for call in self._calls if call[0] == name)} for name, stats in self._stats.items()}
+
+
+flights = SingleFlight()
+
+
+def default_key(arguments: dict) -> tuple:
+    return tuple(sorted((name, value) for name, value in arguments.items() if isinstance(value, KEY_TYPES)))
+
+
+def single_flight(name: str, key: Union[Callable[[dict], Hashable], None] = None, max_wait: float = SINGLE_FLIGHT_MAX_WAIT):
+    """
+    Decorator collapsing concurrent identical calls of the endpoint into one execution.
+
+    ------
+    Parameters
+    name: str of the route, used in the stats
+    key: callable(arguments) returning the key of identical calls, arguments being a dict of the endpoint's arguments.
+         By default the simple arguments (see KEY_TYPES).
+    max_wait: float of the seconds a collapsed call waits for the running one before executing the endpoint itself
+    """
+    make_key = key or default_key
+
+    def decorator(endpoint: Callable) -> Callable:
+        signature = inspect.signature(endpoint)
+        is_coroutine = asyncio.iscoroutinefunction(endpoint)
+
+        #FastAPI reads the parameters of the endpoint through __wrapped__ (functools.wraps).
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+
+            async def execute():
+                if is_coroutine:
+                    return await endpoint(*args, **kwargs)
+                return await run_in_threadpool(endpoint, *args, **kwargs)
+
+            return await flights.do(name, make_key(arguments), execute, max_wait)
+
+        return wrapper
+
+    return decorator
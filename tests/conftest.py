@@ -0,0 +1,41 @@
+"""
+Shared fixtures. The todo application runs on a throwaway sqlite database, set before the package reads its config.
+"""
+
+import os
+import tempfile
+import pytest
+
+DATABASE_DIR = tempfile.mkdtemp(prefix="todo_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(DATABASE_DIR, 'todos.db')}")
+os.environ.setdefault("TODO_TEMPLATE_CACHE_DIR", os.path.join(DATABASE_DIR, "jinja_cache"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from ToDoApp.main import create_app
+
+    #The lifespan creates the tables.
+    with TestClient(create_app()) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def user(client):
+    """A user in the database, as a dict of user_id and username."""
+    from ToDoApp.database import SessionLocal
+    from ToDoApp.routers.auth import hash_password
+    from ToDoApp import models
+
+    #Closed before the test runs, sqlite has a single writer connection.
+    db = SessionLocal()
+    try:
+        new_user = models.Users(username=f"user{os.urandom(4).hex()}", hashed_password=hash_password("password"), is_active=True)
+        db.add(new_user)
+        db.commit()
+        created = {"user_id": new_user.user_id, "username": new_user.username}
+    finally:
+        db.close()
+
+    return created
@@ -0,0 +1,41 @@
+from ToDoApp.admission import AIMDLimiter
+
+
+def make_limiter() -> AIMDLimiter:
+    return AIMDLimiter(initial_limit=32, min_limit=4, max_limit=256, target_latency=0.3, queue_timeout=1, max_queue=10)
+
+
+def finish(limiter: AIMDLimiter, route: str, latency: float) -> None:
+    limiter.in_flight += 1
+    limiter.release("critical", latency, failed=False, route=route)
+    #Every decrease counts, not only one per target latency.
+    limiter._last_decrease = 0.0
+
+
+def test_slow_by_design_route_does_not_shrink_the_limit():
+    limiter = make_limiter()
+
+    for _ in range(20):
+        finish(limiter, "POST /auth/token", 0.43)
+
+    assert limiter.limit >= 32
+
+
+def test_route_slower_than_its_baseline_shrinks_the_limit():
+    limiter = make_limiter()
+
+    for _ in range(5):
+        finish(limiter, "POST /auth/token", 0.43)
+
+    finish(limiter, "POST /auth/token", 1.5)
+
+    assert limiter.limit < 32
+
+
+def test_fast_route_is_held_to_the_target_latency():
+    limiter = make_limiter()
+
+    finish(limiter, "GET /todos/", 0.01)
+    finish(limiter, "GET /todos/", 0.4)
+
+    assert limiter.limit < 32
@@ -0,0 +1,68 @@
+from ToDoApp.database import SessionLocal
+from ToDoApp.routers import auth
+from ToDoApp.routers.auth import ACCESS_TOKEN_EXPIRE, create_access_token, create_refresh_token
+
+
+def change_password(client, token: str):
+    return client.post("/users/change_password", json={"new_password": "new password"}, headers={"Authorization": f"Bearer {token}"})
+
+
+def test_access_token_is_accepted(client, user):
+    token = create_access_token(user["username"], user["user_id"], expires_delta=ACCESS_TOKEN_EXPIRE)
+
+    assert change_password(client, token).status_code == 200
+
+
+def test_refresh_token_is_rejected_as_access_token(client, user):
+    db = SessionLocal()
+    try:
+        refresh_token = create_refresh_token(user["username"], user["user_id"], db)
+        db.commit()
+    finally:
+        db.close()
+
+    assert change_password(client, refresh_token).status_code == 401
+
+
+def test_login_does_not_hold_a_transaction_during_bcrypt(client, user, monkeypatch):
+    sessions = []
+    verify_password = auth.verify_password
+    original_session = auth.SessionLocal
+
+    def session():
+        db = original_session()
+        sessions.append(db)
+        return db
+
+    def checked_verify_password(plain_password, hashed_password):
+        assert not any(db.in_transaction() for db in sessions)
+        return verify_password(plain_password, hashed_password)
+
+    monkeypatch.setattr(auth, "SessionLocal", session)
+    monkeypatch.setattr(auth, "verify_password", checked_verify_password)
+
+    response = client.post("/auth/token/", data={"username": user["username"], "password": "password"})
+
+    assert response.status_code == 200
+    assert sessions
+
+
+def refresh(client, refresh_token: str):
+    return client.post("/auth/refresh", headers={"Cookie": f"refresh_token={refresh_token}"})
+
+
+def test_reused_refresh_token_revokes_its_family(client, user):
+    db = SessionLocal()
+    try:
+        refresh_token = create_refresh_token(user["username"], user["user_id"], db)
+        db.commit()
+    finally:
+        db.close()
+
+    rotated = refresh(client, refresh_token)
+    #The test client keeps the cookies it was sent, the tokens are passed explicitly instead.
+    client.cookies.clear()
+    assert rotated.status_code == 200
+
+    assert refresh(client, refresh_token).status_code == 401
+    assert refresh(client, rotated.cookies["refresh_token"]).status_code == 401
@@ -0,0 +1,17 @@
+from starlette.requests import Request
+from ToDoApp.database import RECENT_WRITE_COOKIE, get_read_db, reads_primary
+
+
+def read_session_routes_to_primary(cookie: str) -> bool:
+    request = Request({"type": "http", "headers": [(b"cookie", cookie.encode())] if cookie else []})
+    sessions = get_read_db(request)
+    db = next(sessions)
+    try:
+        return reads_primary(db)
+    finally:
+        sessions.close()
+
+
+def test_recent_writer_reads_from_the_primary():
+    assert read_session_routes_to_primary(f"{RECENT_WRITE_COOKIE}=1")
+    assert not read_session_routes_to_primary("")
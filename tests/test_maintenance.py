@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+from ToDoApp.database import SessionLocal
+from ToDoApp.maintenance import archive_completed_todos
+from ToDoApp import config
+from ToDoApp import models
+
+
+def test_archive_moves_only_old_completed_todos(client, user):
+    old = datetime.utcnow() - timedelta(days=config.ARCHIVE_AFTER_DAYS + 1)
+    db = SessionLocal()
+    try:
+        archived = models.ToDos(title="old", complete=True, completed_at=old, priority=1, owner_id=user["user_id"])
+        recent = models.ToDos(title="recent", complete=True, completed_at=datetime.utcnow(), priority=1, owner_id=user["user_id"])
+        open_todo = models.ToDos(title="open", complete=False, priority=1, owner_id=user["user_id"])
+        db.add_all([archived, recent, open_todo])
+        db.commit()
+        ids = (archived.todo_id, recent.todo_id, open_todo.todo_id)
+
+        while archive_completed_todos(db, batch_size=100):
+            pass
+
+        hot = {todo_id for (todo_id,) in db.query(models.ToDos.todo_id).filter(models.ToDos.owner_id == user["user_id"])}
+        cold = {todo_id for (todo_id,) in db.query(models.TodosArchive.todo_id).filter(models.TodosArchive.owner_id == user["user_id"])}
+    finally:
+        db.close()
+
+    assert hot == {ids[1], ids[2]}
+    assert cold == {ids[0]}
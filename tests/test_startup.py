@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+from benchmarks.bench_import import LAZY_MODULES
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#Imports the application in a fresh interpreter, as a new worker does, and reports what the import set up.
+IMPORT_SCRIPT = """
+import json, sys
+import ToDoApp.main
+from ToDoApp import database, templating
+from ToDoApp.routers import auth
+
+print(json.dumps({
+    "calls": {function.__name__: function.cache_info().currsize
+              for function in (database.get_engine, database.get_read_engine, auth.get_crypt_context, templating.get_templates)},
+    "modules": [name for name in %r if name in sys.modules]
+}))
+"""
+
+
+def test_import_sets_up_nothing_heavy():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT % (LAZY_MODULES,)], cwd=ROOT, env=os.environ, capture_output=True, text=True, check=True
+    ).stdout
+    startup = json.loads(output.splitlines()[-1])
+
+    #The engines, the password hashing and the templates are set up on first use or by the lifespan, not at import.
+    assert startup["calls"] == {"get_engine": 0, "get_read_engine": 0, "get_crypt_context": 0, "get_templates": 0}
+    assert startup["modules"] == []
@@ -0,0 +1,8 @@
+def test_all_users_are_listed_without_password_hashes(client, user):
+    response = client.get("/users/")
+
+    assert response.status_code == 200
+    listed = next(listed for listed in response.json() if listed["user_id"] == user["user_id"])
+    assert listed["username"] == user["username"]
+    assert "hashed_password" not in listed
+    assert "deleted_at" not in listed